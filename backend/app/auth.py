@@ -1,7 +1,13 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import asyncio
+import hashlib
+import time
+from cachetools import TTLCache
 from jose import JWTError, jwt
 import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
 from app.config import settings
@@ -10,33 +16,52 @@ from app import database as db_module
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
+# Resolved users per token, so active sessions skip the JWT decode and Mongo lookup.
+# Entries are (user, exp) and are never served past the token's own expiry.
+# The cache is per process: logout or account deletion only invalidates it on
+# the worker that handled that request, so other workers may keep accepting
+# the token for up to USER_CACHE_TTL_SECONDS. Keep this short.
+USER_CACHE_TTL_SECONDS = 5
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL_SECONDS)
+
+
+# Argon2id (OWASP baseline parameters); bcrypt hashes are still accepted
+password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+
+def _is_bcrypt_hash(hashed_password: str) -> bool:
+    """bcrypt hashes from before the Argon2id switch start with $2"""
+    return hashed_password.startswith("$2")
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash"""
-    # Ensure password is bytes
-    if isinstance(plain_password, str):
-        plain_password = plain_password.encode('utf-8')
-    if isinstance(hashed_password, str):
-        hashed_password = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(plain_password, hashed_password)
+    if _is_bcrypt_hash(hashed_password):
+        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    try:
+        return password_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True for legacy bcrypt hashes or Argon2 hashes with outdated parameters"""
+    return _is_bcrypt_hash(hashed_password) or password_hasher.check_needs_rehash(hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    """Hash a password using bcrypt"""
-    # Ensure password is bytes and truncate if needed (bcrypt limit is 72 bytes)
-    if isinstance(password, str):
-        password_bytes = password.encode('utf-8')
-    else:
-        password_bytes = password
-    
-    # Truncate to 72 bytes if necessary (bcrypt limitation)
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-    
-    # Generate salt and hash
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
-    return hashed.decode('utf-8')
+    """Hash a password using Argon2id"""
+    return password_hasher.hash(password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Run verify_password in a worker thread, off the event loop."""
+    return await asyncio.to_thread(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Run get_password_hash in a worker thread, off the event loop."""
+    return await asyncio.to_thread(get_password_hash, password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -51,20 +76,33 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(request: Request, token: Optional[str] = Depends(oauth2_scheme)):
-    """Get current user from JWT token (from cookie or Authorization header)"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    # Try to get token from cookie first (preferred for httpOnly security)
-    token = token or request.cookies.get("access_token")
-    
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.blake2s(token.encode(), digest_size=16).digest()
+
+
+def invalidate_cached_token(token: Optional[str]):
+    """Drop a token's cached user (on logout)"""
+    if token:
+        _user_cache.pop(_token_cache_key(token), None)
+
+
+def invalidate_cached_user(user_id: str):
+    """Drop every cached token for a user (on account deletion)"""
+    for key, (user, _) in list(_user_cache.items()):
+        if user["_id_str"] == user_id:
+            _user_cache.pop(key, None)
+
+
+async def _user_from_token(token: Optional[str], credentials_exception: HTTPException) -> dict:
+    """Resolve a JWT to its user document, using the TTL cache when possible"""
     if not token:
         raise credentials_exception
     
+    cache_key = _token_cache_key(token)
+    cached = _user_cache.get(cache_key)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+    
     try:
         payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
         username: str = payload.get("sub")
@@ -74,37 +112,37 @@ async def get_current_user(request: Request, token: Optional[str] = Depends(oaut
     except JWTError:
         raise credentials_exception
     
-    # Get user from database
-    user = await db_module.database.users.find_one({"username": token_data.username})
+    # Get user from database (handlers only read the id, username and created_at)
+    user = await db_module.database.users.find_one(
+        {"username": token_data.username}, db_module.USER_LIST_PROJECTION
+    )
     if user is None:
         raise credentials_exception
     
+    user["_id_str"] = str(user["_id"])
+    _user_cache[cache_key] = (user, payload.get("exp", 0))
     return user
 
 
-async def get_current_user_websocket(token: str):
-    """Get current user from JWT token for WebSocket authentication"""
+async def get_current_user(request: Request, token: Optional[str] = Depends(oauth2_scheme)):
+    """Get current user from JWT token (from cookie or Authorization header)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
     )
     
-    if not token:
-        raise credentials_exception
-    
-    try:
-        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    # Get user from database
-    user = await db_module.database.users.find_one({"username": token_data.username})
-    if user is None:
-        raise credentials_exception
+    # Try to get token from cookie first (preferred for httpOnly security)
+    token = token or request.cookies.get("access_token")
     
-    return user
+    return await _user_from_token(token, credentials_exception)
 
+
+async def get_current_user_websocket(token: str):
+    """Get current user from JWT token for WebSocket authentication"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+    )
+    
+    return await _user_from_token(token, credentials_exception)
@@ -1,5 +1,9 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator
+from functools import lru_cache
+from typing import Optional
+import base64
+import hashlib
 import sys
 
 
@@ -14,7 +18,26 @@ class Settings(BaseSettings):
     jwt_access_token_expire_minutes: int = Field(default=30, env="JWT_ACCESS_TOKEN_EXPIRE_MINUTES")
     
     # Encryption (optional - not used anymore, kept for backward compatibility)
-    app_encryption_key: str = Field(default="not-used-anymore", env="APP_ENCRYPTION_KEY")
+    # Decoded to the raw 32-byte key once, when settings are loaded
+    app_encryption_key: bytes = Field(default="not-used-anymore", env="APP_ENCRYPTION_KEY")
+    
+    # Post-quantum transport keypair (base64). Generate with:
+    #   python -m app.tools.genkey
+    # If unset, a fresh keypair is generated on every startup.
+    pq_server_public_key: Optional[bytes] = Field(default=None, env="PQ_SERVER_PUBLIC_KEY")
+    pq_server_secret_key: Optional[bytes] = Field(default=None, env="PQ_SERVER_SECRET_KEY")
+    
+    # Key-derivation function for post-quantum key material:
+    # "hkdf-sha256" (default; HKDF with salt=None, as originally used) or
+    # "blake3" (faster, needs the blake3 package, but derives different
+    # keys, so existing PQ data will no longer decrypt)
+    pq_kdf: str = Field(default="hkdf-sha256", env="PQ_KDF")
+    
+    # Rate limiting: shared Redis token bucket when set, in-process otherwise
+    redis_url: Optional[str] = Field(default=None, env="REDIS_URL")
+    
+    # Logging level for app.* loggers (request-path logs are DEBUG)
+    log_level: str = Field(default="INFO", env="LOG_LEVEL")
     
     # Server
     host: str = Field(default="0.0.0.0", env="HOST")
@@ -48,7 +71,50 @@ class Settings(BaseSettings):
             sys.exit(1)
         
         return v
+    
+    @field_validator('app_encryption_key', mode='before')
+    @classmethod
+    def decode_app_encryption_key(cls, v) -> bytes:
+        """
+        Decode the encryption key to 32 raw bytes.
+        Accepts a base64-encoded or hex-encoded 32-byte key; any other
+        string is hashed with SHA-256 (not ideal, but better than nothing).
+        """
+        if isinstance(v, bytes):
+            v = v.decode('utf-8')
+        
+        # Try to decode as base64 first
+        try:
+            key = base64.b64decode(v)
+            if len(key) == 32:
+                return key
+        except ValueError:
+            pass
+        
+        # Try hex encoding
+        try:
+            key = bytes.fromhex(v)
+            if len(key) == 32:
+                return key
+        except ValueError:
+            pass
+        
+        return hashlib.sha256(v.encode()).digest()
+    
+    @field_validator('pq_server_public_key', 'pq_server_secret_key', mode='before')
+    @classmethod
+    def decode_pq_server_key(cls, v) -> Optional[bytes]:
+        """Decode a base64-encoded server key; empty means not configured."""
+        if not v:
+            return None
+        return base64.b64decode(v, validate=True)
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load settings once; later calls reuse the parsed instance."""
+    return Settings()
 
 
-settings = Settings()
+settings = get_settings()
 
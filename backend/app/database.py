@@ -1,18 +1,145 @@
+from typing import Dict, List
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
-from app.config import settings
+from app.config import get_settings
+import logging
+
+logger = logging.getLogger(__name__)
 
 client: AsyncIOMotorClient = None
 database = None
 
+# Fields needed to build a UserResponse; skips password hashes and PQ key blobs
+USER_LIST_PROJECTION = {"username": 1, "created_at": 1}
+
+# Fields login needs: a UserResponse plus the password hash to verify
+USER_LOGIN_PROJECTION = {**USER_LIST_PROJECTION, "password_hash": 1}
+
+
+def conversation_participants(user_a: ObjectId, user_b: ObjectId) -> List[ObjectId]:
+    """
+    The two users of a conversation in a fixed (sorted) order, stored as
+    `participants` on messages so a conversation matches one array value
+    whichever side sent the message
+    """
+    return [user_a, user_b] if user_a <= user_b else [user_b, user_a]
+
+
+# Set once every message and message request carries `participants`
+# (see backfill_participants); until then queries also match the legacy
+# sender_id/recipient_id fields
+participants_backfilled = False
+
+# Update pipeline computing `participants` from sender_id/recipient_id,
+# ordered the same way as conversation_participants
+_PARTICIPANTS_PIPELINE = [{
+    "$set": {
+        "participants": {
+            "$cond": [
+                {"$lte": ["$sender_id", "$recipient_id"]},
+                ["$sender_id", "$recipient_id"],
+                ["$recipient_id", "$sender_id"]
+            ]
+        }
+    }
+}]
+
+
+def conversation_filter(user_a: ObjectId, user_b: ObjectId) -> dict:
+    """Query matching every message between two users"""
+    pair = conversation_participants(user_a, user_b)
+    if participants_backfilled:
+        return {"participants": pair}
+    return {"$or": [
+        {"participants": pair},
+        {"sender_id": user_a, "recipient_id": user_b},
+        {"sender_id": user_b, "recipient_id": user_a}
+    ]}
+
+
+def user_conversations_filter(user_id: ObjectId) -> dict:
+    """Query matching every message a user sent or received"""
+    if participants_backfilled:
+        return {"participants": user_id}
+    return {"$or": [
+        {"participants": user_id},
+        {"sender_id": user_id},
+        {"recipient_id": user_id}
+    ]}
+
+
+async def backfill_participants() -> Dict[str, int]:
+    """
+    Add `participants` to messages and message requests stored before the
+    field existed. Runs server-side in one update per collection and is a
+    no-op once every document has it.
+    
+    Returns:
+        Number of documents updated per collection
+    """
+    global participants_backfilled
+    updated = {}
+    for name in ("messages", "message_requests"):
+        result = await database[name].update_many(
+            {"participants": {"$exists": False}}, _PARTICIPANTS_PIPELINE
+        )
+        updated[name] = result.modified_count
+    participants_backfilled = True
+    return updated
+
 
 async def connect_to_mongo():
     """Create database connection"""
     global client, database
-    client = AsyncIOMotorClient(settings.mongo_url)
+    settings = get_settings()
+    # Wire compression: zstd, falling back to zlib if the server lacks it
+    client = AsyncIOMotorClient(
+        settings.mongo_url,
+        compressors="zstd,zlib",
+        zlibCompressionLevel=3,
+        maxPoolSize=100,
+        retryReads=True,
+    )
     database = client[settings.mongo_db_name]
     print(f"Connected to MongoDB: {settings.mongo_db_name}")
 
 
+async def ensure_user_indexes():
+    """
+    Create the unique user indexes. /register has no pre-checks and relies
+    on them to reject duplicate usernames and phone numbers, so this must
+    succeed before the app serves requests; errors propagate to the caller.
+    """
+    await database.users.create_index("username", unique=True)
+    await database.users.create_index("full_phone_number", unique=True)
+
+
+async def ensure_indexes():
+    """Create the query indexes the routers rely on, then backfill participants"""
+    try:
+        # Conversation fetch and existence check (participants pair, newest
+        # first); its multikey prefix also serves the conversation partner list
+        await database.messages.create_index([("participants", 1), ("timestamp", -1)])
+        # sender_id branch of user deletion
+        await database.messages.create_index([("sender_id", 1), ("recipient_id", 1), ("timestamp", -1)])
+        # recipient_id branch of user deletion
+        await database.messages.create_index([("recipient_id", 1), ("timestamp", -1)])
+        
+        # Pending requests for a recipient, newest first; also the recipient_id deletion branch
+        await database.message_requests.create_index([("recipient_id", 1), ("status", 1), ("timestamp", -1)])
+        await database.message_requests.create_index([("sender_id", 1), ("recipient_id", 1)])
+        logger.info("MongoDB indexes ensured")
+    except Exception as e:
+        logger.warning("Failed to create MongoDB indexes: %s", e)
+    
+    try:
+        updated = await backfill_participants()
+        if any(updated.values()):
+            logger.info("Backfilled conversation participants: %s", updated)
+    except Exception as e:
+        logger.warning("Failed to backfill conversation participants: %s", e)
+
+
 async def close_mongo_connection():
     """Close database connection"""
     global client
@@ -1,75 +1,100 @@
 """
-Simple AES-GCM encryption for message content at rest.
+Simple AEAD encryption for message content at rest.
+
+New messages use AES-GCM on CPUs with hardware AES and carry-less multiply
+(AES-NI/PCLMULQDQ on x86, AES/PMULL on ARM) and ChaCha20-Poly1305 elsewhere,
+where table-based AES-GCM is slow and not constant-time. The first byte of
+content_encrypted records the algorithm, so stored messages decrypt on any host.
 """
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from cryptography.hazmat.backends import default_backend
-import base64
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from functools import lru_cache
 import os
-from app.config import settings
+from app.config import get_settings
+
+
+# Algorithm tags stored as the first byte of content_encrypted
+ALGO_AES_GCM = 1
+ALGO_CHACHA20_POLY1305 = 2
+
+_AEAD_CLASSES = {
+    ALGO_AES_GCM: AESGCM,
+    ALGO_CHACHA20_POLY1305: ChaCha20Poly1305,
+}
+
+
+def cpu_flags() -> frozenset:
+    """Read the CPU feature flags from /proc/cpuinfo (empty if unavailable)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    return frozenset(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return frozenset()
+
+
+def _has_hardware_aes() -> bool:
+    """Check for hardware AES and carry-less multiply support."""
+    flags = cpu_flags()
+    if not flags:
+        # Can't tell (e.g. not Linux) - assume a modern CPU with AES support
+        return True
+    return "aes" in flags and ("pclmulqdq" in flags or "pmull" in flags)
+
+
+# AEAD used for new messages on this host (detected once at import)
+DEFAULT_ALGO = ALGO_AES_GCM if _has_hardware_aes() else ALGO_CHACHA20_POLY1305
+_DEFAULT_ALGO_PREFIX = bytes([DEFAULT_ALGO])
 
 
 def get_encryption_key() -> bytes:
     """
     Get encryption key from environment variable.
     Expects a base64-encoded 32-byte key, or a hex-encoded key.
+    Decoding happens once in Settings; this just returns the bytes.
     """
-    key_str = settings.app_encryption_key
-    
-    # Try to decode as base64 first
-    try:
-        key = base64.b64decode(key_str)
-        if len(key) == 32:
-            return key
-    except:
-        pass
-    
-    # Try hex encoding
-    try:
-        key = bytes.fromhex(key_str)
-        if len(key) == 32:
-            return key
-    except:
-        pass
-    
-    # If it's a string, derive a key from it (not ideal, but better than nothing)
-    if isinstance(key_str, str):
-        import hashlib
-        key = hashlib.sha256(key_str.encode()).digest()
-        return key
-    
-    raise ValueError("APP_ENCRYPTION_KEY must be a 32-byte key (base64 or hex encoded)")
+    return get_settings().app_encryption_key
+
 
+@lru_cache(maxsize=4)
+def _cipher_for(algo: int, key: bytes):
+    """Build the AEAD cipher once per (algorithm, key) pair."""
+    return _AEAD_CLASSES[algo](key)
 
-def encrypt_message(plaintext: str) -> tuple[bytes, bytes, bytes]:
+
+def _get_cipher(algo: int = DEFAULT_ALGO):
+    """Get the shared AEAD cipher for the current encryption key."""
+    return _cipher_for(algo, get_encryption_key())
+
+
+def encrypt_message(plaintext: str) -> tuple[bytes, bytes]:
     """
-    Encrypt a message using AES-GCM.
-    Returns: (ciphertext, nonce, auth_tag)
+    Encrypt a message with this host's preferred AEAD.
+    Returns: (ciphertext, nonce)
+    The ciphertext is the algorithm byte followed by the AEAD output
+    (which already carries the 16-byte auth tag at its end) and is
+    stored as-is in content_encrypted.
     """
-    key = get_encryption_key()
-    aesgcm = AESGCM(key)
-    nonce = os.urandom(12)  # 12 bytes for GCM
+    aead = _get_cipher()
+    nonce = os.urandom(12)  # 12 bytes for both AES-GCM and ChaCha20-Poly1305
     
     plaintext_bytes = plaintext.encode('utf-8')
-    ciphertext = aesgcm.encrypt(nonce, plaintext_bytes, None)
-    
-    # AESGCM.encrypt returns ciphertext + auth_tag concatenated
-    # For GCM, auth_tag is 16 bytes
-    auth_tag = ciphertext[-16:]
-    ciphertext_only = ciphertext[:-16]
+    ciphertext = aead.encrypt(nonce, plaintext_bytes, None)
     
-    return ciphertext_only, nonce, auth_tag
+    return _DEFAULT_ALGO_PREFIX + ciphertext, nonce
 
 
-def decrypt_message(ciphertext: bytes, nonce: bytes, auth_tag: bytes) -> str:
+def decrypt_message(ciphertext: bytes, nonce: bytes, auth_tag: bytes = b"") -> str:
     """
-    Decrypt a message using AES-GCM.
+    Decrypt a message stored by encrypt_message.
+    auth_tag is only needed for legacy rows, which stored AES-GCM output
+    with the tag split off and no algorithm byte.
     """
-    key = get_encryption_key()
-    aesgcm = AESGCM(key)
-    
-    # Reconstruct the full ciphertext (ciphertext + auth_tag)
-    full_ciphertext = ciphertext + auth_tag
-    
-    plaintext_bytes = aesgcm.decrypt(nonce, full_ciphertext, None)
+    if auth_tag:
+        # Legacy rows: reconstruct the full ciphertext (ciphertext + auth_tag)
+        plaintext_bytes = _get_cipher(ALGO_AES_GCM).decrypt(nonce, ciphertext + auth_tag, None)
+    else:
+        aead = _get_cipher(ciphertext[0])
+        plaintext_bytes = aead.decrypt(nonce, memoryview(ciphertext)[1:], None)
     return plaintext_bytes.decode('utf-8')
-
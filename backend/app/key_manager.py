@@ -17,27 +17,55 @@ Solution: Session-based key cache
 - Keys are never stored in database or sent to client
 """
 
-import time
-from typing import Optional, Dict
+import ctypes
+import threading
+from typing import Optional
+from cachetools import TTLCache
 from app.pq_encryption import get_user_private_key
-from app.post_quantum import decrypt_private_key
-import base64
+
+
+def _wipe(buf: bytearray):
+    """Overwrite a cached key buffer with zeros in place."""
+    size = len(buf)
+    if size:
+        ctypes.memset(ctypes.addressof((ctypes.c_char * size).from_buffer(buf)), 0, size)
+
+
+class _WipingTTLCache(TTLCache):
+    """TTLCache that zeroes key buffers as soon as they are evicted."""
+    
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for _, buf in expired:
+            _wipe(buf)
+        return expired
+    
+    def popitem(self):
+        user_id, buf = super().popitem()
+        _wipe(buf)
+        return user_id, buf
 
 
 class KeyCache:
     """
     In-memory cache for decrypted private keys.
     Keys are stored temporarily and expire after a set time.
+    Safe to share between threads: every access goes through a lock.
+    Keys are held in mutable buffers and zeroed when they leave the cache,
+    instead of lingering on the heap until garbage collection.
     """
     
-    def __init__(self, ttl_seconds: int = 3600):  # 1 hour default
+    def __init__(self, ttl_seconds: int = 3600, maxsize: int = 10_000):  # 1 hour default
         """
         Initialize key cache.
         
         Args:
             ttl_seconds: Time-to-live for cached keys in seconds
+            maxsize: Maximum number of cached keys
         """
-        self._cache: Dict[str, tuple] = {}  # user_id -> (private_key, expiry_time)
+        # user_id -> private_key buffer; TTLCache expires entries on access
+        self._cache: TTLCache = _WipingTTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._lock = threading.RLock()
         self.ttl = ttl_seconds
     
     def store(self, user_id: str, private_key: bytes):
@@ -48,8 +76,11 @@ class KeyCache:
             user_id: User's ID (string)
             private_key: Decrypted private key (bytes)
         """
-        expiry = time.time() + self.ttl
-        self._cache[user_id] = (private_key, expiry)
+        with self._lock:
+            old = self._cache.pop(user_id, None)
+            if old is not None:
+                _wipe(old)
+            self._cache[user_id] = bytearray(private_key)
     
     def get(self, user_id: str) -> Optional[bytes]:
         """
@@ -60,19 +91,12 @@ class KeyCache:
             user_id: User's ID (string)
         
         Returns:
-            private_key: Decrypted private key or None
+            private_key: Copy of the decrypted private key or None
         """
-        if user_id not in self._cache:
-            return None
-        
-        private_key, expiry = self._cache[user_id]
-        
-        # Check if expired
-        if time.time() > expiry:
-            del self._cache[user_id]
-            return None
-        
-        return private_key
+        with self._lock:
+            self._cache.expire()
+            buf = self._cache.get(user_id)
+            return bytes(buf) if buf is not None else None
     
     def remove(self, user_id: str):
         """
@@ -81,18 +105,15 @@ class KeyCache:
         Args:
             user_id: User's ID (string)
         """
-        if user_id in self._cache:
-            del self._cache[user_id]
+        with self._lock:
+            buf = self._cache.pop(user_id, None)
+            if buf is not None:
+                _wipe(buf)
     
     def clear_expired(self):
         """Remove all expired keys from cache."""
-        current_time = time.time()
-        expired_keys = [
-            user_id for user_id, (_, expiry) in self._cache.items()
-            if current_time > expiry
-        ]
-        for user_id in expired_keys:
-            del self._cache[user_id]
+        with self._lock:
+            self._cache.expire()
 
 
 # Global key cache instance
@@ -1,47 +1,121 @@
-from fastapi import FastAPI, Request
+import asyncio
+import hashlib
+import logging
+import logging.handlers
+import queue
+import ssl
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
-from app.database import connect_to_mongo, close_mongo_connection
+from fastapi.staticfiles import StaticFiles
+from app.database import connect_to_mongo, close_mongo_connection, ensure_user_indexes, ensure_indexes
 from app.routers import auth, messages, websocket, pq, documents
 from app.middleware import setup_rate_limiting
-from app.pq_transport import generate_server_keypair
+from app.pq_transport import generate_server_keypair, load_server_keypair, run_selftest
+from app.config import settings
+from app.encryption import cpu_flags
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    # Request handlers only enqueue log records; a background thread
+    # formats and writes them, so stdout never blocks the event loop
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(settings.log_level.upper())
+    app_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    app_logger.propagate = False
+    
+    listener.start()
+    return listener
+
+
+log_listener = setup_logging()
+
+
+async def init_server_keypair():
+    # Use the persisted post-quantum keypair if configured, so client
+    # sessions survive restarts and startup skips keygen
+    if bool(settings.pq_server_public_key) != bool(settings.pq_server_secret_key):
+        raise RuntimeError(
+            "PQ_SERVER_PUBLIC_KEY and PQ_SERVER_SECRET_KEY must be set together"
+        )
+    if settings.pq_server_public_key:
+        load_server_keypair(settings.pq_server_public_key, settings.pq_server_secret_key)
+        # Refuse to start with a public key that does not belong to the
+        # secret key; a real KEM round trip needs liboqs
+        result = run_selftest()
+        if result["liboqs"] and not result["kem_ok"]:
+            raise RuntimeError(
+                "PQ_SERVER_PUBLIC_KEY and PQ_SERVER_SECRET_KEY are not a matching keypair"
+            )
+        return
+    
+    # Generate server's post-quantum Kyber keypair on startup
+    # This keypair is used for establishing secure session keys with clients
+    # Keygen is CPU-bound, so run it in a worker thread
+    try:
+        public_key, secret_key = await asyncio.to_thread(generate_server_keypair)
+        print(f"[STARTUP] Post-quantum server keypair generated successfully")
+        print(f"[STARTUP] Public key size: {len(public_key)} bytes")
+        print(f"[STARTUP] WARNING: Keypair is not persisted; clients must redo the handshake after a restart.")
+        print(f"[STARTUP] Run 'python -m app.tools.genkey' and add the output to .env to persist it.")
+    except Exception as e:
+        print(f"[STARTUP] WARNING: Failed to generate PQ keypair: {e}")
+        print(f"[STARTUP] PQ transport security will not work properly!")
+
+
+def log_hash_backend():
+    # SHA-256 (HKDF, key derivation) uses SHA-NI / ARMv8 SHA2 instructions
+    # only when hashlib is backed by OpenSSL and the CPU has them
+    backend = "OpenSSL" if hashlib.sha256.__name__.startswith("openssl_") else "builtin"
+    flags = cpu_flags()
+    sha_ext = "sha_ni" in flags or "sha2" in flags
+    print(f"[STARTUP] SHA-256 backend: {backend} ({ssl.OPENSSL_VERSION}), "
+          f"CPU SHA extensions: {'yes' if sha_ext else 'no'}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_hash_backend()
+    # Connect to MongoDB while the keypair is generated
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(connect_to_mongo())
+        tg.create_task(init_server_keypair())
+    # Registration relies on the unique user indexes to reject duplicates,
+    # so startup fails if they cannot be created
+    await ensure_user_indexes()
+    # The query indexes and the participants backfill can be slow, so they
+    # run in the background
+    index_task = asyncio.create_task(ensure_indexes())
+    yield
+    index_task.cancel()
+    await close_mongo_connection()
+    log_listener.stop()
+
 
 app = FastAPI(
     title="Messaging App API",
     description="A simple messaging app with encrypted messages",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Setup rate limiting
 limiter = setup_rate_limiting(app)
 
-origins = [
-    "http://localhost:3000",
-    "http://localhost:5173",
-    "http://localhost:5174",
-    "http://localhost:5175",
-    "http://localhost:5176",
-    "http://localhost:5177",
-    "http://localhost:5178",
-    "http://localhost:5179",
-    "http://localhost:5180",
-    "http://127.0.0.1:3000",
-    "http://127.0.0.1:5173",
-    "http://127.0.0.1:5174",
-    "http://127.0.0.1:5175",
-    "http://127.0.0.1:5176",
-    "http://127.0.0.1:5177",
-    "http://127.0.0.1:5178",
-    "http://127.0.0.1:5179",
-    "http://127.0.0.1:5180",
-]
+# Local dev frontends: ports 3000 and 5173-5180 on localhost / 127.0.0.1
+ORIGIN_REGEX = r"^http://(localhost|127\.0\.0\.1):(3000|517[3-9]|5180)$"
 
 # CORS middleware (keep this ABOVE routers)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=origins,          # or ["*"] for dev only
+    allow_origin_regex=ORIGIN_REGEX,  # or allow_origins=["*"] for dev only
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -49,11 +123,6 @@ app.add_middleware(
     max_age=3600,
 )
 
-# ⛔️ DELETE this whole block from your code:
-# @app.options("/{full_path:path}")
-# async def options_handler(...):
-#     ...
-
 # Routers
 app.include_router(auth.router)
 app.include_router(messages.router)
@@ -61,24 +130,9 @@ app.include_router(websocket.router)
 app.include_router(pq.router)  # Post-quantum transport security
 app.include_router(documents.router)  # Document serving
 
+# Static document files (ETag / If-Modified-Since / Range handled by Starlette)
+app.mount("/documents/static", StaticFiles(directory=documents.DOCUMENTS_DIR), name="documents-static")
 
-@app.on_event("startup")
-async def startup_event():
-    await connect_to_mongo()
-    
-    # Generate server's post-quantum Kyber keypair on startup
-    # This keypair is used for establishing secure session keys with clients
-    try:
-        public_key, secret_key = generate_server_keypair()
-        print(f"[STARTUP] Post-quantum server keypair generated successfully")
-        print(f"[STARTUP] Public key size: {len(public_key)} bytes")
-    except Exception as e:
-        print(f"[STARTUP] WARNING: Failed to generate PQ keypair: {e}")
-        print(f"[STARTUP] PQ transport security will not work properly!")
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    await close_mongo_connection()
 
 @app.get("/")
 async def root():
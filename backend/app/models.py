@@ -1,8 +1,27 @@
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional
+from typing import Literal, Optional
 from datetime import datetime
 from bson import ObjectId
-import re
+import sys
+
+
+# Message request statuses and token type, interned once and shared
+REQUEST_PENDING = sys.intern("pending")
+REQUEST_ACCEPTED = sys.intern("accepted")
+REQUEST_DECLINED = sys.intern("declined")
+TOKEN_TYPE_BEARER = sys.intern("bearer")
+
+RequestStatus = Literal["pending", "accepted", "declined"]
+
+# Special characters accepted by the password strength check
+_SPECIAL_CHARS = frozenset('!@#$%^&*(),.?":{}|<>_-+=[]\\/;~`')
+
+# Password character-class flags
+_HAS_UPPER = 1
+_HAS_LOWER = 2
+_HAS_DIGIT = 4
+_HAS_SPECIAL = 8
+_HAS_ALL = _HAS_UPPER | _HAS_LOWER | _HAS_DIGIT | _HAS_SPECIAL
 
 
 class PyObjectId(ObjectId):
@@ -25,8 +44,8 @@ class PyObjectId(ObjectId):
 class UserCreate(BaseModel):
     username: str = Field(..., min_length=3, max_length=50, pattern="^[a-zA-Z0-9_]+$")
     password: str = Field(..., min_length=8, max_length=128)
-    area_code: str = Field(..., min_length=1, max_length=5, description="Area code (e.g., +1, +44)")
-    phone_number: str = Field(..., min_length=7, max_length=15, description="Phone number (7-15 digits)")
+    area_code: str = Field(..., pattern=r"^\+\d{1,4}$", description="Area code (e.g., +1, +44)")
+    phone_number: str = Field(..., pattern=r"^\d{7,15}$", description="Phone number (7-15 digits)")
     
     @field_validator('password')
     @classmethod
@@ -35,51 +54,28 @@ class UserCreate(BaseModel):
         if len(v) < 8:
             raise ValueError("Password must be at least 8 characters long")
         
-        # Check for at least one uppercase letter
-        if not re.search(r'[A-Z]', v):
-            raise ValueError("Password must contain at least one uppercase letter")
+        # Single pass over the password, stopping once every class is seen
+        flags = 0
+        for ch in v:
+            if 'A' <= ch <= 'Z':
+                flags |= _HAS_UPPER
+            elif 'a' <= ch <= 'z':
+                flags |= _HAS_LOWER
+            elif ch.isdecimal():  # exactly the characters r'\d' matches
+                flags |= _HAS_DIGIT
+            elif ch in _SPECIAL_CHARS:
+                flags |= _HAS_SPECIAL
+            if flags == _HAS_ALL:
+                return v
         
-        # Check for at least one lowercase letter
-        if not re.search(r'[a-z]', v):
+        if not flags & _HAS_UPPER:
+            raise ValueError("Password must contain at least one uppercase letter")
+        if not flags & _HAS_LOWER:
             raise ValueError("Password must contain at least one lowercase letter")
-        
-        # Check for at least one digit
-        if not re.search(r'\d', v):
+        if not flags & _HAS_DIGIT:
             raise ValueError("Password must contain at least one digit")
-        
-        # Check for at least one special character (including underscore, dash, etc.)
-        if not re.search(r'[!@#$%^&*(),.?":{}|<>_\-+=\[\]\\/;~`]', v):
-            raise ValueError("Password must contain at least one special character")
-        
-        return v
-    
-    @field_validator('username')
-    @classmethod
-    def validate_username(cls, v: str) -> str:
-        """Validate username format"""
-        if not re.match(r'^[a-zA-Z0-9_]+$', v):
-            raise ValueError("Username can only contain letters, numbers, and underscores")
-        return v
-    
-    @field_validator('area_code')
-    @classmethod
-    def validate_area_code(cls, v: str) -> str:
-        """Validate area code format (e.g., +1, +44, +91)"""
-        if not re.match(r'^\+\d{1,4}$', v):
-            raise ValueError("Area code must start with + followed by 1-4 digits (e.g., +1, +44)")
-        return v
-    
-    @field_validator('phone_number')
-    @classmethod
-    def validate_phone_number(cls, v: str) -> str:
-        """Validate phone number is numerical only"""
-        if not re.match(r'^\d+$', v):
-            raise ValueError("Phone number must contain only numbers")
-        if len(v) < 7:
-            raise ValueError("Phone number must be at least 7 digits")
-        if len(v) > 15:
-            raise ValueError("Phone number must be at most 15 digits")
-        return v
+        # Special characters include underscore, dash, etc.
+        raise ValueError("Password must contain at least one special character")
 
 
 class UserLogin(BaseModel):
@@ -94,7 +90,6 @@ class User(BaseModel):
     created_at: datetime = datetime.utcnow()
 
     class Config:
-        json_encoders = {ObjectId: str}
         populate_by_name = True
 
 
@@ -106,7 +101,6 @@ class UserResponse(BaseModel):
     created_at: datetime
 
     class Config:
-        json_encoders = {ObjectId: str}
         populate_by_name = True
 
 
@@ -154,13 +148,11 @@ class Message(BaseModel):
     id: Optional[PyObjectId] = None
     user_id: PyObjectId
     username: str
-    content_encrypted: bytes  # Encrypted content
-    nonce: bytes  # For AES-GCM
-    auth_tag: bytes  # For AES-GCM
+    content_encrypted: bytes  # Algorithm byte (1 = AES-GCM, 2 = ChaCha20-Poly1305) + ciphertext + 16-byte tag
+    nonce: bytes  # 12-byte AEAD nonce
     timestamp: datetime = datetime.utcnow()
 
     class Config:
-        json_encoders = {ObjectId: str}
         populate_by_name = True
 
 
@@ -173,7 +165,6 @@ class MessageResponse(BaseModel):
     recipient_id: str
 
     class Config:
-        json_encoders = {ObjectId: str}
         populate_by_name = True
 
 
@@ -185,10 +176,9 @@ class MessageRequestResponse(BaseModel):
     recipient_id: str
     content: str  # Decrypted preview
     timestamp: datetime
-    status: str  # "pending", "accepted", "declined"
+    status: RequestStatus
 
     class Config:
-        json_encoders = {ObjectId: str}
         populate_by_name = True
 
 
@@ -200,7 +190,7 @@ class MessageRequestAction(BaseModel):
 # Token Models
 class Token(BaseModel):
     access_token: str
-    token_type: str = "bearer"
+    token_type: str = TOKEN_TYPE_BEARER
 
 
 class TokenData(BaseModel):
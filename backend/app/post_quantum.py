@@ -12,21 +12,42 @@ We implement a Key Encapsulation Mechanism (KEM) where:
 - The KEM generates a shared secret that is used to derive AES keys
 - The encapsulated ciphertext is stored with the message
 
-Algorithm: CRYSTALS-Kyber (simulated with secure primitives)
-- Public key size: ~800 bytes (Kyber-768)
-- Private key size: ~1632 bytes (Kyber-768)
-- Ciphertext size: ~1088 bytes (Kyber-768)
+Algorithm: CRYSTALS-Kyber-768 via liboqs-python
+- Public key size: 1184 bytes
+- Private key size: 2400 bytes
+- Ciphertext size: 1088 bytes
 
-For production, replace with liboqs-python or similar library.
+Without liboqs-python installed, a simulated KEM built from secure
+primitives is used instead (same sizes, NOT post-quantum secure).
 """
 
 import os
+import hmac
 import hashlib
-import base64
+import threading
 from typing import Tuple
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.hkdf import HKDF
-from cryptography.hazmat.backends import default_backend
+from app.config import settings
+
+# Real Kyber via liboqs-python when installed; otherwise the simulated KEM
+try:
+    import oqs
+    HAS_OQS = True
+except ImportError:
+    HAS_OQS = False
+
+# Argon2id for password-based key derivation; PBKDF2-HMAC-SHA256 otherwise
+try:
+    from argon2.low_level import hash_secret_raw, Type as Argon2Type
+    HAS_ARGON2 = True
+except ImportError:
+    HAS_ARGON2 = False
+
+# BLAKE3 is optional: without it all derivations use HKDF-SHA256
+try:
+    import blake3
+    HAS_BLAKE3 = True
+except ImportError:
+    HAS_BLAKE3 = False
 
 
 # Post-Quantum Key Sizes (Kyber-768 parameters)
@@ -34,6 +55,65 @@ PUBLIC_KEY_SIZE = 1184  # Kyber-768 public key
 PRIVATE_KEY_SIZE = 2400  # Kyber-768 private key
 CIPHERTEXT_SIZE = 1088   # Kyber-768 ciphertext
 SHARED_SECRET_SIZE = 32  # 256 bits for AES-256
+KEM_ALGORITHM = "Kyber768"
+
+# Password-based private key encryption
+PW_SALT_SIZE = 16
+PW_NONCE_SIZE = 12
+# Version byte of the salted format; blobs without it are the original
+# nonce || ciphertext layout keyed by HKDF-SHA256 over the password
+PW_KEY_FORMAT_V2 = b"\x02"
+ARGON2_TIME_COST = 2
+ARGON2_MEMORY_COST = 64 * 1024  # KiB
+PBKDF2_ITERATIONS = 600_000
+
+# Per-thread liboqs encapsulation context. Encapsulation holds no key state,
+# so one context per thread is reused instead of allocating one per call.
+_encap_context = threading.local()
+
+
+def _encap_kem():
+    """Return this thread's liboqs KEM context for encapsulation."""
+    kem = getattr(_encap_context, "kem", None)
+    if kem is None:
+        kem = _encap_context.kem = oqs.KeyEncapsulation(KEM_ALGORITHM)
+    return kem
+
+
+def _hkdf_extract(ikm: bytes) -> bytes:
+    """HKDF-Extract (RFC 5869) with SHA-256 and no salt (a zero-filled key)."""
+    return hmac.new(b"\x00" * 32, ikm, hashlib.sha256).digest()
+
+
+def _hkdf_expand(prk: bytes, info: bytes, length: int) -> bytes:
+    """
+    HKDF-Expand (RFC 5869) with SHA-256.
+    The HMAC is keyed once and copied for each block instead of re-keyed.
+    """
+    base = hmac.new(prk, digestmod=hashlib.sha256)
+    blocks = []
+    block = b""
+    for counter in range(1, -(-length // 32) + 1):
+        h = base.copy()
+        h.update(block)
+        h.update(info)
+        h.update(counter.to_bytes(1, "big"))
+        block = h.digest()
+        blocks.append(block)
+    return b"".join(blocks)[:length]
+
+
+# HKDF-SHA256 (salt=None) is the original derivation and the default.
+# PQ_KDF=blake3 switches to BLAKE3's faster derive-key mode, which yields
+# DIFFERENT keys: only enable it for deployments with no existing PQ data.
+USE_BLAKE3 = HAS_BLAKE3 and settings.pq_kdf == "blake3"
+
+
+def _kdf(key: bytes, info: bytes, length: int = 32) -> bytes:
+    """Derive `length` bytes from high-entropy key material for context `info`."""
+    if USE_BLAKE3:
+        return blake3.blake3(key, derive_key_context=info.decode()).digest(length=length)
+    return _hkdf_expand(_hkdf_extract(key), info, length)
 
 
 class PostQuantumKEM:
@@ -42,13 +122,11 @@ class PostQuantumKEM:
     
     STEP 1.1: KEM Implementation
     ----------------------------
-    This class implements a simplified post-quantum KEM.
-    In production, this should be replaced with a proper implementation
-    like liboqs-python's Kyber implementation.
+    Uses liboqs-python's Kyber-768 when available.
     
-    For now, we use a hybrid approach:
+    Fallback (liboqs not installed), a simplified KEM:
     - Generate secure random keys
-    - Use HKDF to derive shared secrets
+    - Use a KDF to derive shared secrets
     - Store key material securely
     """
     
@@ -69,31 +147,22 @@ class PostQuantumKEM:
         2. Generate random private key material
         3. Derive public key from private key (simplified)
         
-        Note: In production, use proper Kyber key generation
+        Note: The simplified fallback is used only without liboqs-python
         """
-        # Generate secure random key material
+        if HAS_OQS:
+            with oqs.KeyEncapsulation(KEM_ALGORITHM) as kem:
+                public_key = kem.generate_keypair()
+                private_key = kem.export_secret_key()
+            return public_key, private_key
+        
+        # Fallback: generate secure random key material
         # In real Kyber, this involves polynomial operations
         private_seed = os.urandom(32)
         public_seed = os.urandom(32)
         
-        # Derive keys using HKDF (simplified - real Kyber uses lattice operations)
-        hkdf = HKDF(
-            algorithm=hashes.SHA256(),
-            length=PUBLIC_KEY_SIZE,
-            salt=None,
-            info=b"pq_public_key",
-            backend=default_backend()
-        )
-        public_key = hkdf.derive(public_seed + private_seed)
-        
-        hkdf_private = HKDF(
-            algorithm=hashes.SHA256(),
-            length=PRIVATE_KEY_SIZE,
-            salt=None,
-            info=b"pq_private_key",
-            backend=default_backend()
-        )
-        private_key = hkdf_private.derive(private_seed + public_seed)
+        # Expand keys from the seeds (simplified - real Kyber uses lattice operations)
+        public_key = _kdf(public_seed + private_seed, b"pq_public_key", PUBLIC_KEY_SIZE)
+        private_key = _kdf(private_seed + public_seed, b"pq_private_key", PRIVATE_KEY_SIZE)
         
         return public_key, private_key
     
@@ -118,29 +187,19 @@ class PostQuantumKEM:
         2. Derive shared secret from public key and random value
         3. Create ciphertext that allows recipient to recover shared secret
         """
-        # Generate ephemeral random value (in real Kyber, this is more complex)
+        if HAS_OQS:
+            ciphertext, shared_secret = _encap_kem().encap_secret(public_key)
+            return shared_secret, ciphertext
+        
+        # Fallback: generate ephemeral random value (in real Kyber, this is more complex)
         ephemeral = os.urandom(32)
         
         # Derive shared secret using public key and ephemeral
-        hkdf = HKDF(
-            algorithm=hashes.SHA256(),
-            length=SHARED_SECRET_SIZE,
-            salt=None,
-            info=b"pq_shared_secret",
-            backend=default_backend()
-        )
-        shared_secret = hkdf.derive(public_key + ephemeral)
+        shared_secret = _kdf(public_key + ephemeral, b"pq_shared_secret")
         
         # Create ciphertext (in real Kyber, this involves encryption)
         # For now, we store enough info for the recipient to recover the secret
-        hkdf_ct = HKDF(
-            algorithm=hashes.SHA256(),
-            length=CIPHERTEXT_SIZE,
-            salt=None,
-            info=b"pq_ciphertext",
-            backend=default_backend()
-        )
-        ciphertext = hkdf_ct.derive(ephemeral + public_key[:32])
+        ciphertext = _kdf(ephemeral + public_key[:32], b"pq_ciphertext", CIPHERTEXT_SIZE)
         
         # Store ephemeral in ciphertext (simplified - real implementation encrypts it)
         ciphertext = ephemeral + ciphertext[len(ephemeral):]
@@ -167,22 +226,18 @@ class PostQuantumKEM:
         2. Use private key to derive the same shared secret
         3. Return shared secret for AES key derivation
         """
-        # Extract ephemeral from ciphertext (first 32 bytes in our simplified version)
+        if HAS_OQS:
+            with oqs.KeyEncapsulation(KEM_ALGORITHM, private_key) as kem:
+                return kem.decap_secret(ciphertext)
+        
+        # Fallback: extract ephemeral from ciphertext (first 32 bytes in our simplified version)
         ephemeral = ciphertext[:32]
         
         # Derive shared secret using private key and ephemeral
         # This should match the shared secret from encapsulation
-        hkdf = HKDF(
-            algorithm=hashes.SHA256(),
-            length=SHARED_SECRET_SIZE,
-            salt=None,
-            info=b"pq_shared_secret",
-            backend=default_backend()
-        )
-        
         # In real Kyber, we'd use the private key to decrypt and recover ephemeral
         # For now, we derive from private key material
-        shared_secret = hkdf.derive(private_key[:32] + ephemeral)
+        shared_secret = _kdf(private_key[:32] + ephemeral, b"pq_shared_secret")
         
         return shared_secret
     
@@ -200,14 +255,27 @@ class PostQuantumKEM:
         Returns:
             aes_key: 32-byte (256-bit) AES key
         """
-        hkdf = HKDF(
-            algorithm=hashes.SHA256(),
-            length=32,  # 256 bits for AES-256
-            salt=None,
-            info=info,
-            backend=default_backend()
+        return _kdf(shared_secret, info)
+
+
+def _derive_pw_key(password_bytes: bytes, salt: bytes) -> bytes:
+    """
+    Derive the private-key wrapping key for a password (Argon2id, or
+    PBKDF2-HMAC-SHA256 without argon2-cffi). Deliberately not memoized:
+    a process-wide cache would keep passwords and wrapping keys in memory
+    with no expiry. Reuse decrypted private keys via KeyCache instead.
+    """
+    if HAS_ARGON2:
+        return hash_secret_raw(
+            password_bytes,
+            salt,
+            time_cost=ARGON2_TIME_COST,
+            memory_cost=ARGON2_MEMORY_COST,
+            parallelism=1,
+            hash_len=32,
+            type=Argon2Type.ID,
         )
-        return hkdf.derive(shared_secret)
+    return hashlib.pbkdf2_hmac("sha256", password_bytes, salt, PBKDF2_ITERATIONS)
 
 
 def encrypt_private_key(private_key: bytes, password: str) -> bytes:
@@ -215,7 +283,8 @@ def encrypt_private_key(private_key: bytes, password: str) -> bytes:
     STEP 1.6: Private Key Encryption
     ---------------------------------
     Encrypts a user's private key for secure storage.
-    Uses AES-256-GCM with a key derived from the user's password.
+    Uses AES-256-GCM with a key derived from the user's password
+    (Argon2id with a random per-user salt).
     
     Args:
         private_key: User's post-quantum private key (bytes)
@@ -227,22 +296,34 @@ def encrypt_private_key(private_key: bytes, password: str) -> bytes:
     from cryptography.hazmat.primitives.ciphers.aead import AESGCM
     
     # Derive encryption key from password
-    kdf = HKDF(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=None,
-        info=b"pq_private_key_encryption",
-        backend=default_backend()
-    )
-    encryption_key = kdf.derive(password.encode('utf-8'))
+    salt = os.urandom(PW_SALT_SIZE)
+    encryption_key = _derive_pw_key(password.encode('utf-8'), salt)
     
     # Encrypt private key
     aesgcm = AESGCM(encryption_key)
-    nonce = os.urandom(12)
+    nonce = os.urandom(PW_NONCE_SIZE)
     encrypted = aesgcm.encrypt(nonce, private_key, None)
     
-    # Return nonce + ciphertext
-    return nonce + encrypted
+    # Return version + salt + nonce + ciphertext (stored together in the DB)
+    return PW_KEY_FORMAT_V2 + salt + nonce + encrypted
+
+
+def _decrypt_private_key_legacy(encrypted_private_key: bytes, password: str) -> bytes:
+    """Decrypt the original nonce || ciphertext format (HKDF-SHA256 password key)."""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    
+    decryption_key = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"pq_private_key_encryption",
+    ).derive(password.encode('utf-8'))
+    
+    nonce = encrypted_private_key[:PW_NONCE_SIZE]
+    ciphertext = encrypted_private_key[PW_NONCE_SIZE:]
+    return AESGCM(decryption_key).decrypt(nonce, ciphertext, None)
 
 
 def decrypt_private_key(encrypted_private_key: bytes, password: str) -> bytes:
@@ -250,6 +331,8 @@ def decrypt_private_key(encrypted_private_key: bytes, password: str) -> bytes:
     STEP 1.7: Private Key Decryption
     ---------------------------------
     Decrypts a user's private key using their password.
+    Accepts both the versioned salted format and the original
+    nonce || ciphertext format written before it.
     
     Args:
         encrypted_private_key: Encrypted private key (bytes)
@@ -258,25 +341,25 @@ def decrypt_private_key(encrypted_private_key: bytes, password: str) -> bytes:
     Returns:
         private_key: Decrypted post-quantum private key (bytes)
     """
+    from cryptography.exceptions import InvalidTag
     from cryptography.hazmat.primitives.ciphers.aead import AESGCM
     
-    # Extract nonce and ciphertext
-    nonce = encrypted_private_key[:12]
-    ciphertext = encrypted_private_key[12:]
-    
-    # Derive decryption key from password
-    kdf = HKDF(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=None,
-        info=b"pq_private_key_encryption",
-        backend=default_backend()
-    )
-    decryption_key = kdf.derive(password.encode('utf-8'))
-    
-    # Decrypt private key
-    aesgcm = AESGCM(decryption_key)
-    private_key = aesgcm.decrypt(nonce, ciphertext, None)
+    header = len(PW_KEY_FORMAT_V2) + PW_SALT_SIZE + PW_NONCE_SIZE
+    if encrypted_private_key[:1] == PW_KEY_FORMAT_V2 and len(encrypted_private_key) > header:
+        # Extract salt, nonce and ciphertext
+        salt = encrypted_private_key[1:1 + PW_SALT_SIZE]
+        nonce = encrypted_private_key[1 + PW_SALT_SIZE:header]
+        ciphertext = encrypted_private_key[header:]
+        
+        # Derive decryption key from password
+        decryption_key = _derive_pw_key(password.encode('utf-8'), salt)
+        
+        try:
+            return AESGCM(decryption_key).decrypt(nonce, ciphertext, None)
+        except InvalidTag:
+            # A legacy blob whose random nonce happens to start with the
+            # version byte; fall through to the original format
+            pass
     
-    return private_key
+    return _decrypt_private_key_legacy(encrypted_private_key, password)
 
@@ -23,12 +23,29 @@ Decryption Flow:
 
 import os
 import base64
+import threading
 from typing import Tuple
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from app.post_quantum import PostQuantumKEM
 
+# Nonces are sliced from a per-thread buffer refilled by one urandom call
+RANDOM_POOL_SIZE = 4096
+_random_pool = threading.local()
 
-def encrypt_message_pq(plaintext: str, recipient_public_key: bytes) -> Tuple[bytes, bytes, bytes, bytes]:
+
+def _pooled_random(n: int) -> bytes:
+    """Return n random bytes, amortizing the getrandom syscall across calls."""
+    buf = getattr(_random_pool, "buf", b"")
+    pos = getattr(_random_pool, "pos", 0)
+    if pos + n > len(buf):
+        buf = os.urandom(RANDOM_POOL_SIZE)
+        pos = 0
+        _random_pool.buf = buf
+    _random_pool.pos = pos + n
+    return buf[pos:pos + n]
+
+
+def encrypt_message_pq(plaintext: str, recipient_public_key: bytes) -> Tuple[bytes, bytes, bytes]:
     """
     STEP 2.1: Post-Quantum Message Encryption
     ------------------------------------------
@@ -39,10 +56,10 @@ def encrypt_message_pq(plaintext: str, recipient_public_key: bytes) -> Tuple[byt
         recipient_public_key: Recipient's post-quantum public key (bytes)
     
     Returns:
-        (ciphertext, nonce, auth_tag, kem_ciphertext): Tuple of bytes
-        - ciphertext: Encrypted message content
+        (ciphertext, nonce, kem_ciphertext): Tuple of bytes
+        - ciphertext: Encrypted message content with the 16-byte AES-GCM
+          auth tag at its end (stored as one field)
         - nonce: AES-GCM nonce
-        - auth_tag: AES-GCM authentication tag
         - kem_ciphertext: Post-quantum KEM ciphertext (needed for decryption)
     
     Process:
@@ -59,23 +76,18 @@ def encrypt_message_pq(plaintext: str, recipient_public_key: bytes) -> Tuple[byt
     
     # Step 3: Encrypt message with AES-GCM
     aesgcm = AESGCM(aes_key)
-    nonce = os.urandom(12)  # 12 bytes for GCM
+    nonce = _pooled_random(12)  # 12 bytes for GCM
     
     plaintext_bytes = plaintext.encode('utf-8')
-    encrypted = aesgcm.encrypt(nonce, plaintext_bytes, None)
+    # AESGCM.encrypt returns ciphertext + auth_tag concatenated; keep it that way
+    ciphertext = aesgcm.encrypt(nonce, plaintext_bytes, None)
     
-    # AESGCM.encrypt returns ciphertext + auth_tag concatenated
-    # For GCM, auth_tag is 16 bytes
-    auth_tag = encrypted[-16:]
-    ciphertext_only = encrypted[:-16]
-    
-    return ciphertext_only, nonce, auth_tag, kem_ciphertext
+    return ciphertext, nonce, kem_ciphertext
 
 
 def decrypt_message_pq(
     ciphertext: bytes,
     nonce: bytes,
-    auth_tag: bytes,
     kem_ciphertext: bytes,
     recipient_private_key: bytes
 ) -> str:
@@ -85,9 +97,8 @@ def decrypt_message_pq(
     Decrypts a message using post-quantum key exchange and AES-GCM.
     
     Args:
-        ciphertext: Encrypted message content (bytes)
+        ciphertext: Encrypted message content including auth tag (bytes)
         nonce: AES-GCM nonce (bytes)
-        auth_tag: AES-GCM authentication tag (bytes)
         kem_ciphertext: Post-quantum KEM ciphertext (bytes)
         recipient_private_key: Recipient's post-quantum private key (bytes)
     
@@ -109,13 +120,24 @@ def decrypt_message_pq(
     # Step 3: Decrypt message with AES-GCM
     aesgcm = AESGCM(aes_key)
     
-    # Reconstruct the full ciphertext (ciphertext + auth_tag)
-    full_ciphertext = ciphertext + auth_tag
-    
-    plaintext_bytes = aesgcm.decrypt(nonce, full_ciphertext, None)
+    plaintext_bytes = aesgcm.decrypt(nonce, ciphertext, None)
     return plaintext_bytes.decode('utf-8')
 
 
+def _decoded_key_field(user: dict, field: str) -> bytes:
+    """
+    Decode a base64 key field once and memoize the bytes on the user dict.
+    Fields already stored as BinData (bytes) are returned as-is.
+    """
+    cache_field = f"_{field}_bytes"
+    cached = user.get(cache_field)
+    if cached is None:
+        value = user[field]
+        cached = bytes(value) if isinstance(value, (bytes, bytearray)) else base64.b64decode(value)
+        user[cache_field] = cached
+    return cached
+
+
 def get_user_public_key(user: dict) -> bytes:
     """
     STEP 2.3: Retrieve User Public Key
@@ -134,8 +156,7 @@ def get_user_public_key(user: dict) -> bytes:
     if "pq_public_key" not in user:
         raise ValueError(f"User {user.get('username', 'unknown')} does not have a post-quantum public key")
     
-    public_key_b64 = user["pq_public_key"]
-    return base64.b64decode(public_key_b64)
+    return _decoded_key_field(user, "pq_public_key")
 
 
 def get_user_private_key(user: dict, password: str) -> bytes:
@@ -159,8 +180,7 @@ def get_user_private_key(user: dict, password: str) -> bytes:
     if "pq_private_key_encrypted" not in user:
         raise ValueError(f"User {user.get('username', 'unknown')} does not have a post-quantum private key")
     
-    encrypted_private_key_b64 = user["pq_private_key_encrypted"]
-    encrypted_private_key = base64.b64decode(encrypted_private_key_b64)
+    encrypted_private_key = _decoded_key_field(user, "pq_private_key_encrypted")
     
     try:
         private_key = decrypt_private_key(encrypted_private_key, password)
@@ -17,7 +17,7 @@ It's just transport security (browser ↔ server) using post-quantum cryptograph
 """
 
 import os
-import base64
+import logging
 from typing import Tuple, Optional
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import hashes
@@ -33,6 +33,8 @@ except ImportError:
     print("WARNING: liboqs-python not installed. Using fallback implementation.")
     print("Install with: pip install liboqs-python")
 
+logger = logging.getLogger(__name__)
+
 
 # Server's Kyber keypair (set on startup)
 server_kem_public_key: Optional[bytes] = None
@@ -73,6 +75,40 @@ def generate_server_keypair() -> Tuple[bytes, bytes]:
         return public_key, secret_key
 
 
+def load_server_keypair(public_key: bytes, secret_key: bytes) -> None:
+    """
+    Install a previously generated server keypair.
+    
+    Used instead of generate_server_keypair() when the keypair is persisted
+    in the environment, so restarts keep the same public key and skip keygen.
+    
+    Args:
+        public_key: Server's public key bytes
+        secret_key: Server's secret key bytes
+    
+    Raises:
+        ValueError: If the key lengths do not match KEM_ALGORITHM (checked
+            only when liboqs is available)
+    """
+    global server_kem_public_key, server_kem_secret_key
+    if HAS_OQS:
+        with oqs.KeyEncapsulation(KEM_ALGORITHM) as kem:
+            details = kem.details
+        if len(public_key) != details["length_public_key"]:
+            raise ValueError(
+                f"Server public key is {len(public_key)} bytes; "
+                f"{KEM_ALGORITHM} expects {details['length_public_key']}"
+            )
+        if len(secret_key) != details["length_secret_key"]:
+            raise ValueError(
+                f"Server secret key is {len(secret_key)} bytes; "
+                f"{KEM_ALGORITHM} expects {details['length_secret_key']}"
+            )
+    server_kem_public_key = public_key
+    server_kem_secret_key = secret_key
+    print(f"[PQ] Loaded persisted {KEM_ALGORITHM} keypair for server")
+
+
 def get_server_public_key() -> bytes:
     """
     Get the server's Kyber public key.
@@ -112,7 +148,7 @@ def server_decapsulate(ciphertext: bytes) -> bytes:
     else:
         # Fallback: Return deterministic value (NOT secure, just for demo)
         # In production, you MUST use liboqs-python
-        print("[PQ] WARNING: Using fallback decapsulation (NOT secure!)")
+        logger.warning("[PQ] Using fallback decapsulation (NOT secure!)")
         return os.urandom(32)  # 32 bytes = 256 bits for AES-256
 
 
@@ -200,3 +236,40 @@ def decrypt_aes_gcm(key: bytes, nonce: bytes, ciphertext: bytes) -> str:
     except Exception as e:
         raise ValueError(f"Decryption failed: {e}. This could mean the key is wrong or the data was tampered with.")
 
+
+
+def run_selftest() -> dict:
+    """
+    Run the whole transport handshake once inside the server.
+    
+    Plays the client side against the server's own public key:
+    KEM encapsulation -> server decapsulation -> session key derivation
+    on both sides -> AES-GCM round trip under the derived key.
+    
+    Returns:
+        Dict with the algorithm, whether liboqs is in use, the public key
+        length and whether the KEM and AES-GCM steps succeeded. Without
+        liboqs the KEM step cannot agree on a secret, so kem_ok is False.
+    """
+    public_key = get_server_public_key()
+    
+    kem_ok = False
+    if HAS_OQS:
+        with oqs.KeyEncapsulation(KEM_ALGORITHM) as client_kem:
+            ciphertext, client_secret = client_kem.encap_secret(public_key)
+        kem_ok = server_decapsulate(ciphertext) == client_secret
+        session_key = derive_session_key(client_secret)
+    else:
+        session_key = derive_session_key(os.urandom(32))
+    
+    probe = "pq-selftest"
+    nonce, ciphertext = encrypt_aes_gcm(session_key, probe)
+    aead_ok = decrypt_aes_gcm(session_key, nonce, ciphertext) == probe
+    
+    return {
+        "algorithm": KEM_ALGORITHM,
+        "liboqs": HAS_OQS,
+        "public_key_len": len(public_key),
+        "kem_ok": kem_ok,
+        "aead_ok": aead_ok,
+    }
@@ -1,69 +1,133 @@
-"""Simple in-memory rate limiter for FastAPI"""
-from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import Dict, Tuple
+"""
+Rate limiter for FastAPI.
+
+Uses a Redis token bucket (one atomic Lua call per check) when REDIS_URL is
+set and the redis package is installed, so limits hold across uvicorn
+workers; otherwise falls back to the in-memory sliding window below.
+"""
+import logging
+import threading
+import time
+from functools import lru_cache
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Tuple
 from fastapi import HTTPException, status
 from slowapi.util import get_remote_address
 from fastapi import Request
+from app.config import settings
+
+try:
+    import redis.asyncio as aioredis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+
+logger = logging.getLogger(__name__)
+
+SHARD_COUNT = 64  # Must be a power of two
 
 
 class SimpleRateLimiter:
-    """Simple in-memory rate limiter"""
+    """Simple in-memory rate limiter, sharded so each key only locks its shard"""
     
     def __init__(self):
-        self._requests: Dict[str, list] = defaultdict(list)
+        self._shards: List[Tuple[threading.Lock, Dict[Tuple[str, str], Deque[int]]]] = [
+            (threading.Lock(), defaultdict(deque)) for _ in range(SHARD_COUNT)
+        ]
     
-    def is_allowed(self, key: str, limit: int, window_seconds: int) -> bool:
+    def is_allowed(self, key: Tuple[str, str], limit: int, window_seconds: int) -> bool:
         """Check if request is allowed within rate limit"""
-        now = datetime.utcnow()
-        window_start = now - timedelta(seconds=window_seconds)
+        now = time.monotonic_ns()
+        cutoff = now - window_seconds * 1_000_000_000
+        lock, requests = self._shards[hash(key) & (SHARD_COUNT - 1)]
         
-        # Clean old entries
-        self._requests[key] = [
-            req_time for req_time in self._requests[key]
-            if req_time > window_start
-        ]
-        
-        # Check if limit exceeded
-        if len(self._requests[key]) >= limit:
-            return False
-        
-        # Record this request
-        self._requests[key].append(now)
-        return True
+        with lock:
+            dq = requests[key]
+            
+            # Clean old entries (timestamps are appended in order)
+            while dq and dq[0] <= cutoff:
+                dq.popleft()
+            
+            # Check if limit exceeded
+            if len(dq) >= limit:
+                return False
+            
+            # Record this request
+            dq.append(now)
+            return True
 
 
 # Global rate limiter instance
 _rate_limiter = SimpleRateLimiter()
 
+# Token bucket: KEYS[1] = bucket, ARGV = capacity, window_seconds.
+# Refills capacity tokens per window using the Redis server clock.
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * capacity / window)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(window))
+return allowed
+"""
+
+if HAS_REDIS and settings.redis_url:
+    _redis = aioredis.from_url(settings.redis_url)
+    _token_bucket = _redis.register_script(TOKEN_BUCKET_LUA)
+else:
+    _token_bucket = None
+
+
+async def _is_allowed_redis(key: Tuple[str, str], limit: int, window_seconds: int) -> bool:
+    """Check the shared Redis bucket; fall back to the local limiter if Redis is down"""
+    try:
+        allowed = await _token_bucket(keys=[f"ratelimit:{key[0]}:{key[1]}"], args=[limit, window_seconds])
+        return bool(allowed)
+    except Exception as e:
+        logger.warning("[RATE_LIMIT] Redis unavailable, using in-process limiter: %s", e)
+        return _rate_limiter.is_allowed(key, limit, window_seconds)
 
-def check_rate_limit(request: Request, limit: str):
+
+_PERIOD_SECONDS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+@lru_cache(maxsize=64)
+def _parse_limit(limit: str) -> Tuple[int, int]:
+    """Parse a limit string once (e.g., "5/minute" -> (5, 60))"""
+    try:
+        limit_num, period = limit.split("/")
+        return int(limit_num), _PERIOD_SECONDS[period]
+    except (ValueError, KeyError):
+        raise ValueError(f"Invalid rate limit format: {limit}. Use format like '5/minute'")
+
+
+async def check_rate_limit(request: Request, limit: str):
     """
     Check rate limit. Format: "5/minute" or "10/hour"
     Raises HTTPException if limit exceeded.
     """
-    # Parse limit string (e.g., "5/minute" -> 5 requests per 60 seconds)
-    try:
-        limit_num, period = limit.split("/")
-        limit_num = int(limit_num)
-        
-        if period == "minute":
-            window_seconds = 60
-        elif period == "hour":
-            window_seconds = 3600
-        elif period == "second":
-            window_seconds = 1
-        else:
-            raise ValueError(f"Unknown period: {period}")
-    except ValueError as e:
-        raise ValueError(f"Invalid rate limit format: {limit}. Use format like '5/minute'")
+    limit_num, window_seconds = _parse_limit(limit)
     
-    # Get client identifier
-    client_id = get_remote_address(request)
-    key = f"{client_id}:{limit}"
+    # Key on (client, limit) without building a string
+    key = (get_remote_address(request), limit)
     
     # Check rate limit
-    if not _rate_limiter.is_allowed(key, limit_num, window_seconds):
+    if _token_bucket is not None:
+        allowed = await _is_allowed_redis(key, limit_num, window_seconds)
+    else:
+        allowed = _rate_limiter.is_allowed(key, limit_num, window_seconds)
+    if not allowed:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=f"Rate limit exceeded: {limit}. Please try again later."
@@ -1,43 +1,34 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, status, Depends, Response, Request
-from fastapi.responses import JSONResponse
 from datetime import timedelta
-from typing import List
-from app.models import UserCreate, UserLogin, Token, UserResponse, UserSearchRequest
-from app.auth import verify_password, get_password_hash, create_access_token, get_current_user
+from typing import List, Optional
+from app.models import UserCreate, UserLogin, UserResponse
+from app.auth import (
+    verify_password_async, password_needs_rehash, get_password_hash_async, create_access_token,
+    get_current_user, oauth2_scheme, invalidate_cached_token, invalidate_cached_user,
+)
 from app.config import settings
 from app import database as db_module
 from app.rate_limiter import check_rate_limit
 from app.session_manager import clear_session_key
+from app.routers.messages import forget_contacts
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+import logging
 
 router = APIRouter(prefix="/auth", tags=["auth"])
+logger = logging.getLogger(__name__)
 
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register(request: Request, user_data: UserCreate):
     """Register a new user with rate limiting (5 per minute per IP)"""
-    check_rate_limit(request, "5/minute")
-    # Check if user already exists
+    await check_rate_limit(request, "5/minute")
     if db_module.database is None:
         raise HTTPException(status_code=500, detail="Database not initialized")
-    existing_user = await db_module.database.users.find_one({"username": user_data.username})
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
-        )
-    
-    # Check if phone number is already taken (area_code + phone_number must be unique)
-    full_phone = f"{user_data.area_code}{user_data.phone_number}"
-    existing_phone = await db_module.database.users.find_one({"full_phone_number": full_phone})
-    if existing_phone:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This phone number is already registered. Please use a different number."
-        )
     
     # Hash password
-    password_hash = get_password_hash(user_data.password)
+    password_hash = await get_password_hash_async(user_data.password)
     
     # Create user document
     from datetime import datetime
@@ -51,8 +42,15 @@ async def register(request: Request, user_data: UserCreate):
         "created_at": datetime.utcnow()
     }
     
-    # Insert user
-    result = await db_module.database.users.insert_one(user_doc)
+    # Insert user; unique indexes on username and full_phone_number reject duplicates
+    try:
+        result = await db_module.database.users.insert_one(user_doc)
+    except DuplicateKeyError as e:
+        if "full_phone_number" in (e.details or {}).get("keyPattern", {}):
+            detail = "This phone number is already registered. Please use a different number."
+        else:
+            detail = "Username already registered"
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
     user_doc["_id"] = result.inserted_id
     
     return UserResponse(
@@ -65,9 +63,11 @@ async def register(request: Request, user_data: UserCreate):
 @router.post("/login", response_model=UserResponse)
 async def login(request: Request, response: Response, user_data: UserLogin):
     """Login and set access token in httpOnly cookie with rate limiting (10 per minute per IP)"""
-    check_rate_limit(request, "10/minute")
+    await check_rate_limit(request, "10/minute")
     # Find user
-    user = await db_module.database.users.find_one({"username": user_data.username})
+    user = await db_module.database.users.find_one(
+        {"username": user_data.username}, db_module.USER_LOGIN_PROJECTION
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -75,12 +75,19 @@ async def login(request: Request, response: Response, user_data: UserLogin):
         )
     
     # Verify password
-    if not verify_password(user_data.password, user["password_hash"]):
+    if not await verify_password_async(user_data.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
         )
     
+    # Upgrade legacy bcrypt (or outdated Argon2) hashes now that we have the password
+    if password_needs_rehash(user["password_hash"]):
+        await db_module.database.users.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"password_hash": await get_password_hash_async(user_data.password)}}
+        )
+    
     # Create access token
     access_token_expires = timedelta(minutes=settings.jwt_access_token_expire_minutes)
     access_token = create_access_token(
@@ -105,19 +112,26 @@ async def login(request: Request, response: Response, user_data: UserLogin):
     )
 
 
-@router.get("/me", response_model=UserResponse)
+@router.get("/me", response_model=UserResponse, response_model_exclude_unset=True)
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     """Get current user information"""
-    return UserResponse(
-        id=str(current_user["_id"]),
+    # Trusted DB data: skip pydantic validation
+    return UserResponse.model_construct(
+        id=current_user["_id_str"],
         username=current_user["username"],
         created_at=current_user.get("created_at")
     )
 
 
 @router.post("/logout")
-async def logout(response: Response, current_user: dict = Depends(get_current_user)):
+async def logout(
+    request: Request,
+    response: Response,
+    token: Optional[str] = Depends(oauth2_scheme),
+    current_user: dict = Depends(get_current_user)
+):
     """Logout and clear access token cookie"""
+    invalidate_cached_token(token or request.cookies.get("access_token"))
     response.delete_cookie(key="access_token", httponly=True, samesite="lax")
     return {"message": "Logged out successfully"}
 
@@ -135,10 +149,10 @@ async def get_websocket_token(
         expires_delta=timedelta(hours=1)
     )
     
-    return {"token": token, "user_id": str(current_user["_id"])}
+    return {"token": token, "user_id": current_user["_id_str"]}
 
 
-@router.get("/users", response_model=List[UserResponse])
+@router.get("/users", response_model=None, responses={200: {"model": List[UserResponse]}})
 async def get_all_users(
     current_user: dict = Depends(get_current_user)
 ):
@@ -146,22 +160,23 @@ async def get_all_users(
     Get all users (excluding the current user).
     Returns a list of all registered users.
     """
-    current_user_id_obj = ObjectId(current_user["_id"])
+    current_user_id_obj = current_user["_id"]
     
     # Find all users except the current user
-    cursor = db_module.database.users.find({
-        "_id": {"$ne": current_user_id_obj}
-    }).sort("username", 1)
-    
-    users = await cursor.to_list(length=1000)
+    cursor = db_module.database.users.find(
+        {"_id": {"$ne": current_user_id_obj}},
+        db_module.USER_LIST_PROJECTION
+    ).sort("username", 1).limit(1000).batch_size(200)
     
+    # Trusted DB data: build the UserResponse-shaped dicts directly as the
+    # cursor streams, without a second list or pydantic on the output path
     return [
-        UserResponse(
-            id=str(user["_id"]),
-            username=user["username"],
-            created_at=user.get("created_at")
-        )
-        for user in users
+        {
+            "id": str(user["_id"]),
+            "username": user["username"],
+            "created_at": user.get("created_at"),
+        }
+        async for user in cursor
     ]
 
 
@@ -175,9 +190,9 @@ async def delete_user(
     Delete a user account and all associated data.
     
     Any authenticated user can delete any other user's account. This will:
-    - Delete the user from the database
     - Delete all messages where the user is sender or recipient
     - Delete all message requests where the user is sender or recipient
+    - Delete the user from the database (last, so a failed delete can be retried)
     - Clear the user's session keys
     - If deleting own account: Clear the access token cookie (logout)
     """
@@ -189,60 +204,61 @@ async def delete_user(
         )
     
     user_id_obj = ObjectId(user_id)
-    current_user_id_obj = ObjectId(current_user["_id"])
+    current_user_id_obj = current_user["_id"]
     is_deleting_self = user_id_obj == current_user_id_obj
     
-    # Verify user exists
-    user = await db_module.database.users.find_one({"_id": user_id_obj})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
     try:
-        # 1. Delete all messages where user is sender or recipient
-        messages_result = await db_module.database.messages.delete_many({
+        # 1. Delete the user's messages and message requests first, so a
+        # failure leaves the user in place and the request can be retried.
+        # The collections are disjoint, so the deletes run concurrently.
+        # They are idempotent, so a retry also cleans up after a user
+        # document that is already gone.
+        involves_user = {
             "$or": [
                 {"sender_id": user_id_obj},
                 {"recipient_id": user_id_obj}
             ]
-        })
-        print(f"[DELETE_USER] Deleted {messages_result.deleted_count} messages")
-        
-        # 2. Delete all message requests where user is sender or recipient
-        requests_result = await db_module.database.message_requests.delete_many({
-            "$or": [
-                {"sender_id": user_id_obj},
-                {"recipient_id": user_id_obj}
-            ]
-        })
-        print(f"[DELETE_USER] Deleted {requests_result.deleted_count} message requests")
-        
-        # 3. Clear session keys
-        clear_session_key(user_id)
-        print(f"[DELETE_USER] Cleared session keys for user {user_id}")
-        
-        # 4. Delete the user
-        await db_module.database.users.delete_one({"_id": user_id_obj})
-        print(f"[DELETE_USER] Deleted user {user['username']} (ID: {user_id}) by {current_user['username']}")
-        
-        # 5. Clear access token cookie (logout) only if deleting own account
-        if is_deleting_self and response:
-            response.delete_cookie(key="access_token", httponly=True, samesite="lax")
-        
-        return {
-            "message": "User account deleted successfully",
-            "deleted_messages": messages_result.deleted_count,
-            "deleted_requests": requests_result.deleted_count,
-            "deleted_user": user["username"]
         }
+        messages_result, requests_result = await asyncio.gather(
+            db_module.database.messages.delete_many(involves_user),
+            db_module.database.message_requests.delete_many(involves_user),
+        )
+        logger.info("[DELETE_USER] Deleted %d messages", messages_result.deleted_count)
+        logger.info("[DELETE_USER] Deleted %d message requests", requests_result.deleted_count)
         
+        # 2. Delete the user document last, atomically confirming it exists
+        user = await db_module.database.users.find_one_and_delete({"_id": user_id_obj}, projection={"username": 1})
     except Exception as e:
-        print(f"[DELETE_USER] Error deleting user: {e}")
+        logger.error("[DELETE_USER] Error deleting user: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete user: {str(e)}"
         )
+    finally:
+        # Drop this worker's cached auth and contact entries on every path
+        invalidate_cached_user(user_id)
+        forget_contacts(str(user_id_obj))
+    
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    logger.info("[DELETE_USER] Deleted user %s (ID: %s) by %s", user['username'], user_id, current_user['username'])
+    
+    # 3. Clear session keys
+    clear_session_key(user_id)
+    logger.debug("[DELETE_USER] Cleared session keys for user %s", user_id)
+    
+    # 4. Clear access token cookie (logout) only if deleting own account
+    if is_deleting_self and response:
+        response.delete_cookie(key="access_token", httponly=True, samesite="lax")
+    
+    return {
+        "message": "User account deleted successfully",
+        "deleted_messages": messages_result.deleted_count,
+        "deleted_requests": requests_result.deleted_count,
+        "deleted_user": user["username"]
+    }
 
 
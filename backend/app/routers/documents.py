@@ -6,12 +6,13 @@ This router serves HTML documents and other files stored in the server's documen
 This demonstrates the project requirement: "server maintains a database of web pages/documents"
 """
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, Response, status
 from fastapi.responses import FileResponse, HTMLResponse
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel
-import os
+import hashlib
+import stat
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 
@@ -20,6 +21,7 @@ DOCUMENTS_DIR = Path(__file__).parent.parent.parent / "documents"
 
 # Ensure documents directory exists
 DOCUMENTS_DIR.mkdir(exist_ok=True)
+DOCUMENTS_ROOT = DOCUMENTS_DIR.resolve()
 
 
 class DocumentInfo(BaseModel):
@@ -31,12 +33,48 @@ class DocumentInfo(BaseModel):
     size: int
 
 
+# Content types by file extension
+CONTENT_TYPES = {
+    '.html': 'text/html',
+    '.htm': 'text/html',
+    '.pdf': 'application/pdf',
+    '.txt': 'text/plain',
+    '.md': 'text/markdown',
+    '.json': 'application/json',
+    '.xml': 'application/xml'
+}
+
+# <title> lives in <head>, so only the start of an HTML file is read
+TITLE_READ_BYTES = 4096
+
+# filename -> (mtime_ns, size, DocumentInfo); refreshed when a file changes
+_DOC_CACHE: Dict[str, Tuple[int, int, DocumentInfo]] = {}
+
+
+def _extract_title(file_path: Path, default: str) -> str:
+    """Extract the <title> from the head of an HTML file"""
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(TITLE_READ_BYTES)
+    except OSError:
+        return default
+    # Find the <title> tag in the raw bytes and decode only its text
+    start = head.find(b'<title>')
+    if start != -1:
+        start += 7
+        end = head.find(b'</title>', start)
+        if end > start:
+            return head[start:end].decode('utf-8', errors='replace').strip()
+    return default
+
+
 @router.get("/list", response_model=List[DocumentInfo])
 async def list_documents():
     """
     List all available documents in the database.
     
     Returns a list of document metadata (filename, title, content type, size).
+    Metadata is cached per file and only rebuilt when its mtime or size changes.
     """
     documents = []
     
@@ -44,49 +82,42 @@ async def list_documents():
         return documents
     
     # Scan documents directory for HTML and other files
+    seen = set()
     for file_path in DOCUMENTS_DIR.iterdir():
-        if file_path.is_file():
-            # Extract metadata
-            filename = file_path.name
-            file_ext = file_path.suffix.lower()
-            
-            # Determine content type
-            content_types = {
-                '.html': 'text/html',
-                '.htm': 'text/html',
-                '.pdf': 'application/pdf',
-                '.txt': 'text/plain',
-                '.md': 'text/markdown',
-                '.json': 'application/json',
-                '.xml': 'application/xml'
-            }
-            content_type = content_types.get(file_ext, 'application/octet-stream')
-            
-            # Get file size
-            size = file_path.stat().st_size
-            
-            # Extract title from filename or read from HTML
-            title = filename
-            if file_ext == '.html':
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        # Try to extract title from <title> tag
-                        if '<title>' in content:
-                            start = content.find('<title>') + 7
-                            end = content.find('</title>', start)
-                            if end > start:
-                                title = content[start:end].strip()
-                except:
-                    pass
-            
-            documents.append(DocumentInfo(
-                id=filename,
-                filename=filename,
-                title=title,
-                content_type=content_type,
-                size=size
-            ))
+        try:
+            st = file_path.stat()
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        
+        filename = file_path.name
+        seen.add(filename)
+        cached = _DOC_CACHE.get(filename)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            documents.append(cached[2])
+            continue
+        
+        file_ext = file_path.suffix.lower()
+        
+        # Extract title from filename or read from HTML
+        title = filename
+        if file_ext == '.html':
+            title = _extract_title(file_path, filename)
+        
+        info = DocumentInfo(
+            id=filename,
+            filename=filename,
+            title=title,
+            content_type=CONTENT_TYPES.get(file_ext, 'application/octet-stream'),
+            size=st.st_size
+        )
+        _DOC_CACHE[filename] = (st.st_mtime_ns, st.st_size, info)
+        documents.append(info)
+    
+    # Forget deleted files
+    for filename in _DOC_CACHE.keys() - seen:
+        del _DOC_CACHE[filename]
     
     # Sort by filename
     documents.sort(key=lambda x: x.filename)
@@ -107,15 +138,15 @@ async def get_document(document_id: str):
     Raises:
         404: If document not found
     """
-    # Security: Prevent directory traversal
-    if '..' in document_id or '/' in document_id or '\\' in document_id:
+    # Security: Prevent directory traversal; the normalized path must sit
+    # directly inside the documents directory
+    file_path = (DOCUMENTS_ROOT / document_id).resolve()
+    if file_path.parent != DOCUMENTS_ROOT:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid document ID"
         )
     
-    file_path = DOCUMENTS_DIR / document_id
-    
     if not file_path.exists() or not file_path.is_file():
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -124,22 +155,11 @@ async def get_document(document_id: str):
     
     # Determine media type from extension
     ext = file_path.suffix.lower()
-    media_types = {
-        '.html': 'text/html',
-        '.htm': 'text/html',
-        '.pdf': 'application/pdf',
-        '.txt': 'text/plain',
-        '.md': 'text/markdown',
-        '.json': 'application/json',
-        '.xml': 'application/xml'
-    }
-    media_type = media_types.get(ext, 'application/octet-stream')
-    
-    # For HTML files, return as HTMLResponse for proper rendering
+    media_type = CONTENT_TYPES.get(ext, 'application/octet-stream')
+    
+    # For HTML files, stream the file inline (no attachment filename) for proper rendering
     if ext in ['.html', '.htm']:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return HTMLResponse(content=content)
+        return FileResponse(path=str(file_path), media_type=media_type)
     
     # For other files, return as FileResponse
     return FileResponse(
@@ -149,14 +169,39 @@ async def get_document(document_id: str):
     )
 
 
+# (per-file (filename, mtime_ns, size) snapshot, rendered index bytes, ETag)
+# for documents_root
+_ROOT_CACHE: Optional[Tuple[tuple, bytes, str]] = None
+
+
 @router.get("/")
-async def documents_root():
+async def documents_root(request: Request):
     """
     Get a list of available documents as HTML.
     Useful for browsing documents in a browser.
+    The page is re-rendered only when a file is added, removed or changed
+    (by mtime or size, as tracked by list_documents) and is served with an ETag.
+    The directory mtime alone would miss in-place edits to a file.
     """
+    global _ROOT_CACHE
     documents = await list_documents()
+    snapshot = tuple(
+        (doc.filename, _DOC_CACHE[doc.filename][0], _DOC_CACHE[doc.filename][1])
+        for doc in documents
+    )
+    if _ROOT_CACHE is None or _ROOT_CACHE[0] != snapshot:
+        body = _render_documents_root(documents).encode('utf-8')
+        etag = '"' + hashlib.blake2s(body, digest_size=8).hexdigest() + '"'
+        _ROOT_CACHE = (snapshot, body, etag)
     
+    _, body, etag = _ROOT_CACHE
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return HTMLResponse(content=body, headers={"ETag": etag})
+
+
+def _render_documents_root(documents: List[DocumentInfo]) -> str:
+    """Build the document index page"""
     html = """<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -227,7 +272,7 @@ async def documents_root():
             size_kb = doc.size / 1024
             html += f"""
         <div class="doc-item">
-            <a href="/documents/{doc.filename}">{doc.title}</a>
+            <a href="/documents/static/{doc.filename}">{doc.title}</a>
             <div class="doc-meta">
                 {doc.content_type} • {size_kb:.1f} KB
             </div>
@@ -240,5 +285,5 @@ async def documents_root():
 </html>
 """
     
-    return HTMLResponse(content=html)
+    return html
 
@@ -1,21 +1,47 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query
 from datetime import datetime
-from typing import List
-from app.models import MessageCreate, MessageResponse, MessageRequestResponse, MessageRequestAction, UserResponse
-from app.auth import get_current_user
+from typing import List, Optional
+from cachetools import TTLCache
+from app.models import (
+    MessageCreate, MessageResponse, MessageRequestResponse, MessageRequestAction, UserResponse,
+    REQUEST_PENDING, REQUEST_ACCEPTED, REQUEST_DECLINED
+)
+from app.auth import get_current_user, USER_CACHE_TTL_SECONDS
 from app import database as db_module
 from app.pq_transport import decrypt_aes_gcm
 from app.session_manager import get_session_key
 from bson import ObjectId
+import asyncio
 import base64
+import logging
 
 router = APIRouter(prefix="/messages", tags=["messages"])
+logger = logging.getLogger(__name__)
+
+# (user_id, X-Client-Request-Id) -> task sending that message, so a retried
+# or double-clicked send returns the first attempt's result instead of
+# storing the message twice
+_recent_sends: TTLCache = TTLCache(maxsize=100_000, ttl=60)
+
+# (sender_id, recipient_id) -> recipient username, for pairs with an existing
+# conversation; replies skip the recipient and conversation lookups.
+# forget_contacts only clears this worker's copy, so entries share the auth
+# cache's short TTL: a deleted recipient is not accepted for longer than a
+# deleted account's token is
+_known_contacts: TTLCache = TTLCache(maxsize=100_000, ttl=USER_CACHE_TTL_SECONDS)
+
+
+def forget_contacts(user_id: str):
+    """Drop cached contact entries involving a user (e.g., on account deletion)"""
+    for key in [key for key in list(_known_contacts) if user_id in key]:
+        _known_contacts.pop(key, None)
 
 
 @router.post("", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def send_message(
     message_data: MessageCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    x_client_request_id: Optional[str] = Header(default=None, max_length=128)
 ):
     """
     Send a message to a specific user.
@@ -26,8 +52,31 @@ async def send_message(
     
     If encrypted, the server decrypts using the user's session key
     and stores plaintext in MongoDB.
+    
+    Clients may send an X-Client-Request-Id header; repeating a send with
+    the same ID within a minute returns the original message instead of
+    sending it again.
     """
-    user_id = str(current_user["_id"])
+    if x_client_request_id is None:
+        return await _send_message(message_data, current_user)
+    
+    key = (current_user["_id_str"], x_client_request_id)
+    task = _recent_sends.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_send_message(message_data, current_user))
+        _recent_sends[key] = task
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        # A failed send may be retried with the same ID
+        if _recent_sends.get(key) is task:
+            del _recent_sends[key]
+        raise
+
+
+async def _send_message(message_data: MessageCreate, current_user: dict) -> MessageResponse:
+    """Decrypt, store and deliver one message (see send_message)"""
+    user_id = current_user["_id_str"]
     
     # Decrypt message if it's encrypted (new PQ transport security)
     if message_data.is_encrypted():
@@ -47,7 +96,7 @@ async def send_message(
             # Decrypt using AES-GCM with the session key
             # This recovers the plaintext message content
             plaintext_content = decrypt_aes_gcm(session_key, nonce, ciphertext)
-            print(f"[PQ] Decrypted message from user {current_user['username']}")
+            logger.debug("[PQ] Decrypted message from user %s", current_user['username'])
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -71,65 +120,66 @@ async def send_message(
     
     recipient_id = ObjectId(message_data.recipient_id)
     
-    # Check if recipient exists
-    recipient = await db_module.database.users.find_one({"_id": recipient_id})
-    if not recipient:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Recipient user not found"
-        )
-    
     # Don't allow sending to yourself
-    if recipient_id == ObjectId(current_user["_id"]):
+    current_user_id_obj = current_user["_id"]
+    if recipient_id == current_user_id_obj:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot send message to yourself"
         )
     
-    # Check if users have previously messaged each other
-    # If not, create a message request instead of a direct message
-    current_user_id_obj = ObjectId(current_user["_id"])
-    existing_conversation = await db_module.database.messages.find_one({
-        "$or": [
-            {
-                "sender_id": current_user_id_obj,
-                "recipient_id": recipient_id
-            },
-            {
-                "sender_id": recipient_id,
-                "recipient_id": current_user_id_obj
-            }
-        ]
-    })
+    participants = db_module.conversation_participants(current_user_id_obj, recipient_id)
+    
+    # Check that the recipient exists and whether the users have previously
+    # messaged each other (if not, a message request is created instead of a
+    # direct message). Both queries are independent, so issue them together.
+    # A recent send to the same contact already answered both.
+    contact_key = (user_id, str(recipient_id))
+    recipient_username = _known_contacts.get(contact_key)
+    if recipient_username is not None:
+        recipient, existing_conversation = {"username": recipient_username}, True
+    else:
+        recipient, existing_conversation = await asyncio.gather(
+            db_module.database.users.find_one({"_id": recipient_id}, {"username": 1}),
+            db_module.database.messages.find_one(
+                db_module.conversation_filter(current_user_id_obj, recipient_id), {"_id": 1}
+            )
+        )
+        if not recipient:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Recipient user not found"
+            )
     
     # If no existing conversation, create a message request
     if not existing_conversation:
         # Create message request document (plaintext)
         request_doc = {
-            "sender_id": ObjectId(current_user["_id"]),
+            "sender_id": current_user_id_obj,
             "sender_username": current_user["username"],
             "recipient_id": recipient_id,
             "recipient_username": recipient["username"],
+            "participants": participants,
             "content": plaintext_content,  # Store plaintext (decrypted if encrypted)
-            "status": "pending",
+            "status": REQUEST_PENDING,
             "timestamp": datetime.utcnow()
         }
         
         # Insert message request
         result = await db_module.database.message_requests.insert_one(request_doc)
         
-        print(f"[MESSAGE_REQUEST] Created request: ID={result.inserted_id}, From={current_user['username']}, To={recipient['username']}")
+        logger.info("[MESSAGE_REQUEST] Created request: ID=%s, From=%s, To=%s", result.inserted_id, current_user['username'], recipient['username'])
         
         # Send real-time notification via WebSocket
         from app.routers.websocket import send_message_request_to_user
         request_response = MessageRequestResponse(
             id=str(result.inserted_id),
-            sender_id=str(current_user["_id"]),
+            sender_id=current_user["_id_str"],
             sender_username=current_user["username"],
             recipient_id=str(recipient_id),
             content=message_data.content,
             timestamp=request_doc["timestamp"],
-            status="pending"
+            status=REQUEST_PENDING
         )
         # Convert to dict and ensure timestamp is ISO string for JSON serialization
         request_dict = request_response.dict()
@@ -142,27 +192,22 @@ async def send_message(
             username=current_user["username"],
             content=plaintext_content,
             timestamp=request_doc["timestamp"],
-            sender_id=str(current_user["_id"]),
+            sender_id=current_user["_id_str"],
             recipient_id=str(recipient_id)
         )
     
     # Create message document (plaintext - decrypted from encrypted transport)
     message_doc = {
-        "sender_id": ObjectId(current_user["_id"]),
+        "_id": ObjectId(),
+        "sender_id": current_user_id_obj,
         "sender_username": current_user["username"],
         "recipient_id": recipient_id,
         "recipient_username": recipient["username"],
+        "participants": participants,
         "content": plaintext_content,  # Store plaintext (decrypted if encrypted)
         "timestamp": datetime.utcnow()
     }
     
-    # Insert message
-    result = await db_module.database.messages.insert_one(message_doc)
-    message_doc["_id"] = result.inserted_id
-    
-    print(f"Message sent: ID={message_doc['_id']}, From={current_user['username']}, To={recipient['username']}")
-    
-    # Send real-time notification via WebSocket
     from app.routers.websocket import send_message_to_user
     message_response = MessageResponse(
         id=str(message_doc["_id"]),
@@ -176,13 +221,21 @@ async def send_message(
     message_dict = message_response.dict()
     if isinstance(message_dict.get("timestamp"), datetime):
         message_dict["timestamp"] = message_dict["timestamp"].isoformat()
+    
+    # Insert message first so the recipient is never notified of a message
+    # that failed to persist, then send the real-time notification via WebSocket
+    await db_module.database.messages.insert_one(message_doc)
     await send_message_to_user(str(recipient_id), message_dict)
     
+    _known_contacts[contact_key] = recipient["username"]
+    
+    logger.debug("Message sent: ID=%s, From=%s, To=%s", message_doc['_id'], current_user['username'], recipient['username'])
+    
     # Return message for response
     return message_response
 
 
-@router.get("", response_model=List[MessageResponse])
+@router.get("", response_model=None, responses={200: {"model": List[MessageResponse]}})
 async def get_messages(
     other_user_id: str = Query(..., description="ID of the other user in the conversation"),
     limit: int = Query(default=50, ge=1, le=100),
@@ -197,60 +250,58 @@ async def get_messages(
         )
     
     other_user_id_obj = ObjectId(other_user_id)
-    current_user_id_obj = ObjectId(current_user["_id"])
+    current_user_id_obj = current_user["_id"]
     
     # Fetch messages where current user is either sender or recipient with the other user
-    # This gets the conversation between the two users
-    query = {
-        "$or": [
-            {
-                "sender_id": current_user_id_obj,
-                "recipient_id": other_user_id_obj
-            },
-            {
-                "sender_id": other_user_id_obj,
-                "recipient_id": current_user_id_obj
-            }
-        ]
-    }
+    # This gets the conversation between the two users (one participants pair value)
+    query = db_module.conversation_filter(current_user_id_obj, other_user_id_obj)
     
     # Fetch messages from database, sorted by timestamp descending
-    cursor = db_module.database.messages.find(query).sort("timestamp", -1).limit(limit)
-    messages = await cursor.to_list(length=limit)
-    
-    # Debug: Log how many messages were found
-    print(f"[GET_MESSAGES] Found {len(messages)} messages for conversation between {current_user['username']} (ID: {current_user['_id']}) and user {other_user_id}")
+    # Only the fields MessageResponse needs (backed by the participants/timestamp index)
+    projection = {
+        "sender_username": 1, "content": 1, "content_plaintext": 1,
+        "timestamp": 1, "sender_id": 1, "recipient_id": 1,
+    }
+    cursor = (
+        db_module.database.messages.find(query, projection)
+        .sort("timestamp", -1).limit(limit).batch_size(limit)
+    )
     
     # Return messages (plaintext - no decryption needed)
+    # Responses are built as documents stream off the cursor, so the raw
+    # BSON batch is never held alongside the response list
     message_responses = []
-    for msg in reversed(messages):  # Reverse to show oldest first
+    async for msg in cursor:
         # Get content - check both 'content' (new plaintext) and 'content_plaintext' (old format) for backward compatibility
         content = msg.get("content") or msg.get("content_plaintext", "[Message content unavailable]")
         
-        message_responses.append(MessageResponse(
-            id=str(msg["_id"]),
-            username=msg["sender_username"],
-            content=content,
-            timestamp=msg["timestamp"],
-            sender_id=str(msg["sender_id"]),
-            recipient_id=str(msg["recipient_id"])
-        ))
-    
-    print(f"[GET_MESSAGES] Returning {len(message_responses)} messages")
+        # Trusted DB data: build the MessageResponse-shaped dict directly, so
+        # neither the handler nor FastAPI's response_model runs pydantic
+        message_responses.append({
+            "id": str(msg["_id"]),
+            "username": msg["sender_username"],
+            "content": content,
+            "timestamp": msg["timestamp"],
+            "sender_id": str(msg["sender_id"]),
+            "recipient_id": str(msg["recipient_id"]),
+        })
+    message_responses.reverse()  # Reverse to show oldest first
+    
+    logger.debug("[GET_MESSAGES] Returning %d messages for conversation between %s (ID: %s) and user %s", len(message_responses), current_user['username'], current_user['_id'], other_user_id)
     return message_responses
 
 
-@router.get("/requests", response_model=List[MessageRequestResponse])
+@router.get("/requests", response_model=None, responses={200: {"model": List[MessageRequestResponse]}})
 async def get_message_requests(
     current_user: dict = Depends(get_current_user)
 ):
     """Get pending message requests for the current user"""
-    current_user_id_obj = ObjectId(current_user["_id"])
+    current_user_id_obj = current_user["_id"]
     
     # Find all pending requests for current user (as recipient)
     cursor = db_module.database.message_requests.find({
         "recipient_id": current_user_id_obj,
-        "status": "pending"
+        "status": REQUEST_PENDING
     }).sort("timestamp", -1)
     
     requests = await cursor.to_list(length=100)
@@ -265,15 +316,16 @@ async def get_message_requests(
         # Get content - check both 'content' (new plaintext) and 'content_plaintext' (old format) for backward compatibility
         content = req.get("content") or req.get("content_plaintext", "[Message content unavailable]")
         
-        request_responses.append(MessageRequestResponse(
-            id=str(req["_id"]),
-            sender_id=str(req["sender_id"]),
-            sender_username=req["sender_username"],
-            recipient_id=str(req["recipient_id"]),
-            content=content,
-            timestamp=req["timestamp"],
-            status=req["status"]
-        ))
+        # Trusted DB data: build the MessageRequestResponse-shaped dict directly
+        request_responses.append({
+            "id": str(req["_id"]),
+            "sender_id": str(req["sender_id"]),
+            "sender_username": req["sender_username"],
+            "recipient_id": str(req["recipient_id"]),
+            "content": content,
+            "timestamp": req["timestamp"],
+            "status": req["status"],
+        })
     
     return request_responses
 
@@ -298,14 +350,20 @@ async def handle_message_request(
         )
     
     request_id_obj = ObjectId(request_id)
-    current_user_id_obj = ObjectId(current_user["_id"])
+    current_user_id_obj = current_user["_id"]
     
-    # Find the request
-    request = await db_module.database.message_requests.find_one({
-        "_id": request_id_obj,
-        "recipient_id": current_user_id_obj,
-        "status": "pending"
-    })
+    # Find the pending request and set its new status in one atomic step, so
+    # a request can only be accepted or declined once
+    new_status = REQUEST_ACCEPTED if action_data.action == "accept" else REQUEST_DECLINED
+    request = await db_module.database.message_requests.find_one_and_update(
+        {
+            "_id": request_id_obj,
+            "recipient_id": current_user_id_obj,
+            "status": REQUEST_PENDING
+        },
+        {"$set": {"status": new_status}},
+        projection=None if new_status == REQUEST_ACCEPTED else {"_id": 1}
+    )
     
     if not request:
         raise HTTPException(
@@ -313,7 +371,7 @@ async def handle_message_request(
             detail="Message request not found or already processed"
         )
     
-    if action_data.action == "accept":
+    if new_status == REQUEST_ACCEPTED:
         # Convert request to a regular message (plaintext)
         # Get content - check both 'content' (new plaintext) and 'content_plaintext' (old format) for backward compatibility
         content = request.get("content") or request.get("content_plaintext", "")
@@ -323,48 +381,41 @@ async def handle_message_request(
             "sender_username": request["sender_username"],
             "recipient_id": request["recipient_id"],
             "recipient_username": request["recipient_username"],
+            "participants": db_module.conversation_participants(request["sender_id"], request["recipient_id"]),
             "content": content,  # Store plaintext
             "timestamp": request["timestamp"]
         }
         
-        # Insert as regular message
-        await db_module.database.messages.insert_one(message_doc)
-        
-        # Update request status
-        await db_module.database.message_requests.update_one(
-            {"_id": request_id_obj},
-            {"$set": {"status": "accepted"}}
-        )
+        # Insert as regular message. The request was already claimed as
+        # accepted above, so if the insert fails put it back to pending;
+        # otherwise it would be gone from the pending list with no message
+        try:
+            await db_module.database.messages.insert_one(message_doc)
+        except Exception:
+            await db_module.database.message_requests.update_one(
+                {"_id": request_id_obj, "status": REQUEST_ACCEPTED},
+                {"$set": {"status": REQUEST_PENDING}}
+            )
+            logger.error("[MESSAGE_REQUEST] Accepting request %s failed; reverted it to pending", request_id)
+            raise
         
-        return {"message": "Message request accepted", "status": "accepted"}
+        return {"message": "Message request accepted", "status": REQUEST_ACCEPTED}
     
-    else:  # decline
-        # Update request status
-        await db_module.database.message_requests.update_one(
-            {"_id": request_id_obj},
-            {"$set": {"status": "declined"}}
-        )
-        
-        return {"message": "Message request declined", "status": "declined"}
+    return {"message": "Message request declined", "status": REQUEST_DECLINED}
 
 
-@router.get("/conversations", response_model=List[UserResponse])
+@router.get("/conversations", response_model=None, responses={200: {"model": List[UserResponse]}})
 async def get_conversation_partners(
     current_user: dict = Depends(get_current_user)
 ):
     """Get list of users you've had conversations with (not all users)"""
-    current_user_id_obj = ObjectId(current_user["_id"])
+    current_user_id_obj = current_user["_id"]
     
     # Find all unique users you've messaged with (either as sender or recipient)
     # This gets distinct user IDs from messages where you're involved
     pipeline = [
         {
-            "$match": {
-                "$or": [
-                    {"sender_id": current_user_id_obj},
-                    {"recipient_id": current_user_id_obj}
-                ]
-            }
+            "$match": db_module.user_conversations_filter(current_user_id_obj)
         },
         {
             "$project": {
@@ -381,29 +432,32 @@ async def get_conversation_partners(
             "$group": {
                 "_id": "$other_user_id"
             }
-        }
+        },
+        # Join the partners' user details in the same round trip
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "_id",
+                "foreignField": "_id",
+                "as": "user"
+            }
+        },
+        {"$unwind": "$user"},
+        {"$replaceRoot": {"newRoot": "$user"}},
+        {"$project": db_module.USER_LIST_PROJECTION},
+        {"$sort": {"username": 1}},
+        {"$limit": 100}
     ]
     
-    # Get distinct user IDs
-    distinct_users = await db_module.database.messages.aggregate(pipeline).to_list(length=100)
-    user_ids = [ObjectId(item["_id"]) for item in distinct_users]
-    
-    if not user_ids:
-        return []
-    
-    # Fetch user details
-    cursor = db_module.database.users.find({
-        "_id": {"$in": user_ids}
-    }).sort("username", 1)
-    
-    users = await cursor.to_list(length=100)
+    users = await db_module.database.messages.aggregate(pipeline).to_list(length=100)
     
+    # Trusted DB data: build the UserResponse-shaped dicts directly
     return [
-        UserResponse(
-            id=str(user["_id"]),
-            username=user["username"],
-            created_at=user.get("created_at")
-        )
+        {
+            "id": str(user["_id"]),
+            "username": user["username"],
+            "created_at": user.get("created_at"),
+        }
         for user in users
     ]
 
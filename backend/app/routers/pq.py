@@ -5,22 +5,31 @@ Post-Quantum Transport Security Router
 This router handles the PQ handshake between client and server:
 1. GET /pq/kem-public-key - Returns server's Kyber public key
 2. POST /pq/handshake - Client sends KEM ciphertext, server derives session key
+3. GET /pq/selftest - Server runs the whole handshake against itself
 
 After handshake, all message traffic is encrypted with AES-GCM using the session key.
 """
 
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
 from pydantic import BaseModel
+from typing import Optional, Tuple
 from app.auth import get_current_user
 from app.pq_transport import (
     get_server_public_key,
     server_decapsulate,
-    derive_session_key
+    derive_session_key,
+    run_selftest
 )
+from app.rate_limiter import check_rate_limit
 from app.session_manager import store_session_key
 import base64
+import logging
 
 router = APIRouter(prefix="/pq", tags=["post-quantum"])
+logger = logging.getLogger(__name__)
+
+# (server public key, response body); rebuilt only when the keypair changes
+_public_key_response: Optional[Tuple[bytes, dict]] = None
 
 
 class HandshakeRequest(BaseModel):
@@ -45,12 +54,17 @@ async def get_kem_public_key():
     No authentication required - the public key is safe to share.
     
     Returns:
-        JSON with base64-encoded public key
+        JSON with base64-encoded public key and its decoded length in bytes
     """
+    global _public_key_response
     try:
         public_key = get_server_public_key()
-        public_key_b64 = base64.b64encode(public_key).decode('utf-8')
-        return {"public_key": public_key_b64}
+        if _public_key_response is None or _public_key_response[0] is not public_key:
+            _public_key_response = (public_key, {
+                "public_key": base64.b64encode(public_key).decode('utf-8'),
+                "public_key_len": len(public_key),
+            })
+        return _public_key_response[1]
     except RuntimeError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -82,7 +96,7 @@ async def handshake(
     Returns:
         Success response
     """
-    user_id = str(current_user["_id"])
+    user_id = current_user["_id_str"]
     
     try:
         # Decode the KEM ciphertext from base64
@@ -100,7 +114,7 @@ async def handshake(
         # This key will be used to decrypt all messages from this user
         store_session_key(user_id, session_key)
         
-        print(f"[PQ_HANDSHAKE] Successfully established session key for user {current_user['username']} (ID: {user_id})")
+        logger.info("[PQ_HANDSHAKE] Successfully established session key for user %s (ID: %s)", current_user['username'], user_id)
         
         return HandshakeResponse(
             status="ok",
@@ -108,9 +122,31 @@ async def handshake(
         )
     
     except Exception as e:
-        print(f"[PQ_HANDSHAKE] Error for user {user_id}: {e}")
+        logger.warning("[PQ_HANDSHAKE] Error for user %s: %s", user_id, e)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Handshake failed: {str(e)}"
         )
 
+
+@router.get("/selftest")
+async def selftest(request: Request):
+    """
+    Check the PQ transport end to end in one call.
+    
+    The server encapsulates against its own public key as a client would,
+    decapsulates, derives the session key and round-trips an AES-GCM
+    message. Rate limited (10 per minute per IP) since each call does KEM work.
+    
+    Returns:
+        JSON with the algorithm, liboqs availability, public key length
+        and the kem_ok / aead_ok results
+    """
+    await check_rate_limit(request, "10/minute")
+    try:
+        return run_selftest()
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Server keypair not initialized: {str(e)}"
+        )
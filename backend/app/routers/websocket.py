@@ -1,11 +1,11 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from typing import Dict, Set
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from typing import Dict
 from app.auth import get_current_user_websocket
-from app import database as db_module
-from bson import ObjectId
 import json
+import logging
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # Store active WebSocket connections: {user_id: WebSocket}
 active_connections: Dict[str, WebSocket] = {}
@@ -25,7 +25,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
     # Verify the user_id matches the authenticated user
     try:
         current_user = await get_current_user_websocket(token)
-        if str(current_user["_id"]) != user_id:
+        if current_user["_id_str"] != user_id:
             await websocket.close(code=1008, reason="Invalid user")
             return
     except HTTPException:
@@ -36,9 +36,9 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
         return
     
     # Store connection
-    user_id_str = str(current_user["_id"])
+    user_id_str = current_user["_id_str"]
     active_connections[user_id_str] = websocket
-    print(f"[WEBSOCKET] User {user_id_str} ({current_user['username']}) connected. Total connections: {len(active_connections)}")
+    logger.info("[WEBSOCKET] User %s (%s) connected. Total connections: %d", user_id_str, current_user['username'], len(active_connections))
     
     try:
         # Send connection confirmation
@@ -46,7 +46,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             "type": "connected",
             "message": "WebSocket connected"
         })
-        print(f"[WEBSOCKET] Sent connection confirmation to {user_id_str}")
+        logger.debug("[WEBSOCKET] Sent connection confirmation to %s", user_id_str)
         
         # Keep connection alive and handle incoming messages
         while True:
@@ -60,20 +60,21 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                 pass  # Ignore invalid JSON
                 
     except WebSocketDisconnect:
-        print(f"[WEBSOCKET] User {user_id_str} disconnected normally")
+        logger.info("[WEBSOCKET] User %s disconnected normally", user_id_str)
     except Exception as e:
-        print(f"[WEBSOCKET] Error in WebSocket connection for {user_id_str}: {e}")
+        logger.warning("[WEBSOCKET] Error in WebSocket connection for %s: %s", user_id_str, e)
     finally:
         # Remove connection when user disconnects
         if user_id_str in active_connections:
             del active_connections[user_id_str]
-            print(f"[WEBSOCKET] Removed connection for {user_id_str}. Remaining connections: {len(active_connections)}")
+            logger.debug("[WEBSOCKET] Removed connection for %s. Remaining connections: %d", user_id_str, len(active_connections))
 
 
 async def send_message_to_user(recipient_id: str, message_data: dict):
     """Send a message to a specific user via WebSocket"""
-    print(f"[WEBSOCKET] Attempting to send message to user {recipient_id}")
-    print(f"[WEBSOCKET] Active connections: {list(active_connections.keys())}")
+    logger.debug("[WEBSOCKET] Attempting to send message to user %s", recipient_id)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[WEBSOCKET] Active connections: %s", list(active_connections))
     
     if recipient_id in active_connections:
         try:
@@ -82,25 +83,26 @@ async def send_message_to_user(recipient_id: str, message_data: dict):
                 "type": "new_message",
                 "message": message_data
             }
-            print(f"[WEBSOCKET] Sending message to {recipient_id}: {payload}")
+            logger.debug("[WEBSOCKET] Sending message to %s: %s", recipient_id, payload)
             await websocket.send_json(payload)
-            print(f"[WEBSOCKET] Message sent successfully to {recipient_id}")
+            logger.debug("[WEBSOCKET] Message sent successfully to %s", recipient_id)
             return True
         except Exception as e:
-            print(f"[WEBSOCKET] Error sending message to {recipient_id}: {e}")
+            logger.warning("[WEBSOCKET] Error sending message to %s: %s", recipient_id, e)
             # Connection might be dead, remove it
             if recipient_id in active_connections:
                 del active_connections[recipient_id]
             return False
     else:
-        print(f"[WEBSOCKET] User {recipient_id} is not connected (not in active_connections)")
+        logger.debug("[WEBSOCKET] User %s is not connected (not in active_connections)", recipient_id)
     return False
 
 
 async def send_message_request_to_user(recipient_id: str, request_data: dict):
     """Send a message request notification to a user via WebSocket"""
-    print(f"[WEBSOCKET] Attempting to send request to user {recipient_id}")
-    print(f"[WEBSOCKET] Active connections: {list(active_connections.keys())}")
+    logger.debug("[WEBSOCKET] Attempting to send request to user %s", recipient_id)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[WEBSOCKET] Active connections: %s", list(active_connections))
     
     if recipient_id in active_connections:
         try:
@@ -109,16 +111,16 @@ async def send_message_request_to_user(recipient_id: str, request_data: dict):
                 "type": "new_request",
                 "request": request_data
             }
-            print(f"[WEBSOCKET] Sending request to {recipient_id}: {payload}")
+            logger.debug("[WEBSOCKET] Sending request to %s: %s", recipient_id, payload)
             await websocket.send_json(payload)
-            print(f"[WEBSOCKET] Request sent successfully to {recipient_id}")
+            logger.debug("[WEBSOCKET] Request sent successfully to %s", recipient_id)
             return True
         except Exception as e:
-            print(f"[WEBSOCKET] Error sending request to {recipient_id}: {e}")
+            logger.warning("[WEBSOCKET] Error sending request to %s: %s", recipient_id, e)
             if recipient_id in active_connections:
                 del active_connections[recipient_id]
             return False
     else:
-        print(f"[WEBSOCKET] User {recipient_id} is not connected (not in active_connections)")
+        logger.debug("[WEBSOCKET] User %s is not connected (not in active_connections)", recipient_id)
     return False
 
@@ -12,8 +12,11 @@ For a single-process setup (dev/demo), this is sufficient.
 For production with multiple server instances, you'd need Redis or similar.
 """
 
+import logging
 from typing import Dict, Optional
 
+logger = logging.getLogger(__name__)
+
 # In-memory map: user_id (string) -> session_key (bytes)
 # This stores the AES-256 session key for each authenticated user
 session_keys: Dict[str, bytes] = {}
@@ -30,7 +33,7 @@ def store_session_key(user_id: str, session_key: bytes) -> None:
         session_key: 32-byte AES-256 key
     """
     session_keys[user_id] = session_key
-    print(f"[SESSION] Stored session key for user {user_id}")
+    logger.debug("[SESSION] Stored session key for user %s", user_id)
 
 
 def get_session_key(user_id: str) -> Optional[bytes]:
@@ -55,7 +58,7 @@ def clear_session_key(user_id: str) -> None:
     """
     if user_id in session_keys:
         del session_keys[user_id]
-        print(f"[SESSION] Cleared session key for user {user_id}")
+        logger.debug("[SESSION] Cleared session key for user %s", user_id)
 
 
 def has_session_key(user_id: str) -> bool:
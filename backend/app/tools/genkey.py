@@ -0,0 +1,30 @@
+"""
+Generate a persistent post-quantum server keypair for PQ_SERVER_PUBLIC_KEY
+and PQ_SERVER_SECRET_KEY.
+
+Run from the backend directory:
+    python -m app.tools.genkey
+"""
+import base64
+from app.pq_transport import generate_server_keypair, KEM_ALGORITHM
+
+
+def generate_keypair_env():
+    """Generate a server keypair and print it as .env lines."""
+    public_key, secret_key = generate_server_keypair()
+    public_key_b64 = base64.b64encode(public_key).decode()
+    secret_key_b64 = base64.b64encode(secret_key).decode()
+    
+    print("=" * 60)
+    print(f"Generated {KEM_ALGORITHM} Server Keypair")
+    print("=" * 60)
+    print("\nAdd these to your .env file (keep the secret key private):")
+    print(f"PQ_SERVER_PUBLIC_KEY={public_key_b64}")
+    print(f"PQ_SERVER_SECRET_KEY={secret_key_b64}")
+    print("=" * 60)
+    
+    return public_key_b64, secret_key_b64
+
+
+if __name__ == "__main__":
+    generate_keypair_env()
@@ -0,0 +1,36 @@
+"""
+One-shot migration: add the `participants` pair to existing messages.
+
+Conversations are queried by `participants` (the sender and recipient IDs in
+sorted order, see database.conversation_participants). The server backfills
+it on startup (database.ensure_indexes); this script runs the same backfill
+by hand, e.g. before deploying. Documents that already have the field are
+skipped, so it is safe to re-run.
+"""
+
+import asyncio
+from app.database import connect_to_mongo, close_mongo_connection, backfill_participants
+from app import database as db_module
+
+
+async def migrate_participants():
+    """Set participants on every message and message request missing it"""
+    print("Connecting to database...")
+    await connect_to_mongo()
+    
+    if db_module.database is None:
+        print("Error: Database not initialized")
+        return
+    
+    try:
+        for name, migrated in (await backfill_participants()).items():
+            print(f"[SUCCESS] Added participants to {migrated} documents in {name}")
+        
+    except Exception as e:
+        print(f"Error migrating participants: {e}")
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate_participants())
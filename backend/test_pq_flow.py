@@ -3,68 +3,77 @@ Quick test to verify PQ encryption flow is working
 Run this while the server is running to test the full flow
 """
 
+from orjson import loads as orjson_loads
 import requests
-import base64
-import json
+from requests.adapters import HTTPAdapter
+import sys
 
 BASE_URL = "http://localhost:8000"
 
+# (connect, read) timeouts in seconds, so a stuck server fails the run
+# instead of hanging it
+REQUEST_TIMEOUT = (0.5, 2.0)
+
+# One keep-alive connection reused across runs
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+
 def test_pq_flow():
     print("=" * 60)
     print("Testing Post-Quantum Transport Security Flow")
     print("=" * 60)
     print()
     
-    # Step 1: Get server's public key
-    print("Step 1: Getting server's Kyber public key...")
+    # The server runs the whole handshake against itself, so one request
+    # covers the public key, KEM encapsulation/decapsulation and AES-GCM
+    print("Running server-side PQ self-test...")
     try:
-        r = requests.get(f"{BASE_URL}/pq/kem-public-key")
-        if r.status_code != 200:
-            print(f"[ERROR] Failed to get public key: {r.status_code}")
-            return False
-        data = r.json()
-        public_key_b64 = data["public_key"]
-        print(f"[OK] Got public key: {len(base64.b64decode(public_key_b64))} bytes")
+        # Streamed: the body is only read (straight from the socket, without
+        # requests caching it as .content) once the status is known to be OK
+        with SESSION.get(f"{BASE_URL}/pq/selftest", stream=True, timeout=REQUEST_TIMEOUT) as r:
+            if r.status_code != 200:
+                print(f"[ERROR] Self-test failed: {r.status_code}")
+                return False
+            result = orjson_loads(r.raw.read(decode_content=True))
     except Exception as e:
         print(f"[ERROR] Failed: {e}")
         return False
     
-    # Step 2: Simulate client encapsulation (simplified - would use real Kyber in production)
-    print("\nStep 2: Simulating client KEM encapsulation...")
-    print("[NOTE] In production, frontend would use real Kyber library here")
-    print("[OK] Handshake endpoint exists and is accessible")
-    
-    # Step 3: Test that handshake endpoint exists
-    print("\nStep 3: Testing handshake endpoint...")
-    try:
-        # This will fail without auth, but we're just checking the endpoint exists
-        r = requests.post(f"{BASE_URL}/pq/handshake", json={"ciphertext": "test"})
-        # We expect 401 (unauthorized) or 400 (bad ciphertext), not 404
-        if r.status_code == 404:
-            print("[ERROR] Handshake endpoint not found!")
+    print(f"[OK] Got {result['algorithm']} public key: {result['public_key_len']} bytes")
+    if result["liboqs"]:
+        if not result["kem_ok"]:
+            print("[ERROR] KEM shared secrets do not match!")
             return False
-        print(f"[OK] Handshake endpoint exists (got {r.status_code}, expected 401/400)")
-    except Exception as e:
-        print(f"[ERROR] Failed: {e}")
+        print("[OK] KEM encapsulation/decapsulation agree on the shared secret")
+    else:
+        print("[NOTE] liboqs-python not installed on the server; KEM runs in fallback mode")
+    if not result["aead_ok"]:
+        print("[ERROR] AES-GCM round trip under the session key failed!")
         return False
+    print("[OK] AES-GCM round trip under the derived session key")
     
-    print("\n" + "=" * 60)
-    print("[SUCCESS] PQ endpoints are working!")
-    print("=" * 60)
-    print()
-    print("What's working:")
-    print("  ✅ Server generates Kyber keypair on startup")
-    print("  ✅ /pq/kem-public-key endpoint works")
-    print("  ✅ /pq/handshake endpoint exists")
-    print("  ✅ Handshake completes successfully (see server logs)")
-    print("  ✅ Session keys are stored (see server logs)")
-    print()
-    print("From your server logs, I can see:")
-    print("  ✅ [PQ] Generated Kyber512 keypair for server")
-    print("  ✅ [PQ_HANDSHAKE] Successfully established session key")
-    print("  ✅ [SESSION] Stored session key for user")
-    print()
-    print("Your backend is PQ-safe and working correctly! 🎉")
+    # Summary is written in one go rather than line by line; it only
+    # claims what the self-test actually checked
+    if result["liboqs"]:
+        kem_line = f"  ✅ {result['algorithm']} KEM encapsulation/decapsulation agree"
+        verdict = "[SUCCESS] PQ endpoints are working!"
+    else:
+        kem_line = "  ⚠️  KEM ran in fallback mode (liboqs-python missing): NOT post-quantum secure"
+        verdict = "[SUCCESS] Endpoints work, but the server is not using real Kyber"
+    sys.stdout.write("\n".join([
+        "",
+        "=" * 60,
+        verdict,
+        "=" * 60,
+        "",
+        "What was checked:",
+        f"  ✅ Server serves a {result['algorithm']} public key ({result['public_key_len']} bytes)",
+        "  ✅ /pq/selftest endpoint works",
+        kem_line,
+        "  ✅ AES-GCM transport encryption round-trips under the session key",
+    ]) + "\n")
     return True
 
 if __name__ == "__main__":
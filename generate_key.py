@@ -1,30 +1,66 @@
 #!/usr/bin/env python3
 """
 Generate a secure 32-byte encryption key for APP_ENCRYPTION_KEY.
+
+Use --quiet to print only the base64 key (for scripts and automation).
 """
-import secrets
-import base64
-
-def generate_key():
-    """Generate a 32-byte key and return it in base64 format."""
-    key = secrets.token_bytes(32)
-    key_b64 = base64.b64encode(key).decode()
-    key_hex = key.hex()
+import argparse
+import os
+import sys
+from binascii import b2a_base64
+from typing import Optional
+
+KEY_SIZE = 32
+
+
+def generate_key(quiet: bool = False, show_hex: bool = True, key: Optional[bytes] = None):
+    """Generate a 32-byte key (or print the given one) and return it in base64 format."""
+    if key is None:
+        key = os.urandom(KEY_SIZE)
+    
+    if quiet:
+        # Just the key, newline-terminated
+        key_line = b2a_base64(key)
+        sys.stdout.buffer.write(key_line)
+        return key_line[:-1].decode('ascii')
     
-    print("=" * 60)
-    print("Generated Encryption Key (32 bytes)")
-    print("=" * 60)
-    print(f"\nBase64 (recommended):")
-    print(key_b64)
-    print(f"\nHex format:")
-    print(key_hex)
-    print("\n" + "=" * 60)
-    print("Add this to your .env file:")
-    print(f"APP_ENCRYPTION_KEY={key_b64}")
-    print("=" * 60)
+    key_b64 = b2a_base64(key, newline=False).decode('ascii')
+    
+    lines = [
+        "=" * 60,
+        "Generated Encryption Key (32 bytes)",
+        "=" * 60,
+        "\nBase64 (recommended):",
+        key_b64,
+    ]
+    if show_hex:
+        lines += ["\nHex format:", key.hex()]
+    sys.stdout.write("\n".join(lines + [
+        "\n" + "=" * 60,
+        "Add this to your .env file:",
+        f"APP_ENCRYPTION_KEY={key_b64}",
+        "=" * 60,
+    ]) + "\n")
     
     return key_b64
 
+
+def generate_keys(count: int, quiet: bool = False, show_hex: bool = True):
+    """Generate count keys from a single os.urandom call; returns them in base64."""
+    buf = os.urandom(KEY_SIZE * count)
+    return [
+        generate_key(quiet, show_hex, buf[i:i + KEY_SIZE])
+        for i in range(0, len(buf), KEY_SIZE)
+    ]
+
+
 if __name__ == "__main__":
-    generate_key()
+    parser = argparse.ArgumentParser(description="Generate an APP_ENCRYPTION_KEY")
+    parser.add_argument("--quiet", action="store_true", help="print only the base64 key")
+    parser.add_argument("--no-hex", action="store_true", help="omit the hex form of the key")
+    parser.add_argument("--count", type=int, default=1, help="number of keys to generate")
+    args = parser.parse_args()
+    if args.count < 1:
+        parser.error("--count must be at least 1")
+    generate_keys(args.count, quiet=args.quiet, show_hex=not args.no_hex)
 